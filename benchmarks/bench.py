@@ -0,0 +1,399 @@
+"""
+Benchmarks for marshal and unmarshal
+
+Run every benchmark and print a table:
+
+    python -m benchmarks.bench
+
+Save the results to compare releases, and compare a later run against them:
+
+    python -m benchmarks.bench --json before.json
+    python -m benchmarks.bench --compare before.json
+
+Print the encoded size of each scenario per codec:
+
+    python -m benchmarks.bench --sizes
+
+Each scenario is measured for pymarshaler and, where it makes sense, for a stdlib `json` + hand written construction
+baseline so regressions can be told apart from machine noise
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+import platform
+import statistics
+import sys
+import timeit
+import typing
+from dataclasses import dataclass
+from enum import Enum
+
+import orjson
+
+import pymarshaler
+from pymarshaler.marshal import Marshal
+
+_BENCHMARKS = []
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark. The decorated function receives nothing and returns the zero-argument callable to time
+    """
+    def wrapper(setup):
+        _BENCHMARKS.append((name, setup))
+        return setup
+    return wrapper
+
+
+@dataclass
+class Flat:
+    name: str
+    value: int
+    ratio: float
+    enabled: bool
+
+
+@dataclass
+class Inner:
+    name: str
+    value: int
+
+
+@dataclass
+class Outer:
+    inner: Inner
+    inner_list: typing.List[Inner]
+
+
+@dataclass
+class MoreInner:
+    ids: typing.List[typing.Tuple[int]]
+
+
+@dataclass
+class InnerTest:
+    more_inner: MoreInner
+
+
+@dataclass
+class Deep:
+    inner: InnerTest
+
+
+@dataclass
+class WideDict:
+    values: typing.Dict[str, Inner]
+
+
+class Status(Enum):
+    ACTIVE = 'active'
+    INACTIVE = 'inactive'
+    SUSPENDED = 'suspended'
+
+
+@dataclass
+class WithEnum:
+    status: Status
+    statuses: typing.List[Status]
+
+
+@dataclass
+class Event:
+    created: datetime.datetime
+    updated: datetime.datetime
+
+
+class Point:
+
+    def __init__(self, x: int, y: int):
+        self.x = x
+        self.y = y
+
+
+@dataclass
+class WithDelegate:
+    points: typing.List[Point]
+
+
+def _point_delegate(data):
+    return Point(data[0], data[1])
+
+
+def _marshal_with_delegate(codegen: bool = False):
+    marshal = Marshal(codegen=codegen)
+    marshal.register_delegate(Point, _point_delegate)
+    return marshal
+
+
+_NOW = datetime.datetime(2021, 6, 1, 12, 30, 15, 123456)
+
+_SCENARIOS = {
+    'flat': (Flat, Flat('flat', 1, 0.5, True)),
+    'nested_list': (Outer, Outer(Inner('inner', 0), [Inner(f'inner_{i}', i) for i in range(10000)])),
+    'deep': (Deep, Deep(InnerTest(MoreInner([(i, i) for i in range(100)])))),
+    'wide_dict': (WideDict, WideDict({f'key_{i}': Inner(f'inner_{i}', i) for i in range(1000)})),
+    'enum': (WithEnum, WithEnum(Status.ACTIVE, [Status.INACTIVE, Status.SUSPENDED] * 500)),
+    'datetime': (Event, Event(_NOW, _NOW + datetime.timedelta(days=1))),
+}
+
+
+def _register_scenarios():
+    for scenario, (cls, obj) in _SCENARIOS.items():
+        blob = Marshal.marshal(obj)
+
+        def unmarshal(cls=cls, blob=blob):
+            marshal = Marshal()
+            return lambda: marshal.unmarshal_str(cls, blob)
+
+        def unmarshal_codegen(cls=cls, blob=blob):
+            marshal = Marshal(codegen=True)
+            return lambda: marshal.unmarshal_str(cls, blob)
+
+        def marshal(obj=obj):
+            return lambda: Marshal.marshal(obj)
+
+        benchmark(f'unmarshal/{scenario}')(unmarshal)
+        benchmark(f'unmarshal_codegen/{scenario}')(unmarshal_codegen)
+        benchmark(f'marshal/{scenario}')(marshal)
+
+
+_register_scenarios()
+
+
+@benchmark('unmarshal/registered_delegate')
+def _unmarshal_registered_delegate():
+    marshal = _marshal_with_delegate()
+    blob = orjson.dumps({'points': [[i, i] for i in range(10000)]})
+    return lambda: marshal.unmarshal_str(WithDelegate, blob)
+
+
+@benchmark('unmarshal_codegen/registered_delegate')
+def _unmarshal_codegen_registered_delegate():
+    marshal = _marshal_with_delegate(codegen=True)
+    blob = orjson.dumps({'points': [[i, i] for i in range(10000)]})
+    return lambda: marshal.unmarshal_str(WithDelegate, blob)
+
+
+@benchmark('marshal/registered_delegate')
+def _marshal_registered_delegate():
+    obj = WithDelegate([Point(i, i) for i in range(10000)])
+    return lambda: Marshal.marshal(obj)
+
+
+@benchmark('unmarshal_lazy/nested_list_partial_read')
+def _unmarshal_lazy_partial_read():
+    marshal = Marshal(lazy=True)
+    data = orjson.loads(Marshal.marshal(_SCENARIOS['nested_list'][1]))
+    return lambda: marshal.unmarshal(Outer, data).inner.name
+
+
+@benchmark('unmarshal/nested_list_partial_read')
+def _unmarshal_partial_read():
+    marshal = Marshal()
+    data = orjson.loads(Marshal.marshal(_SCENARIOS['nested_list'][1]))
+    return lambda: marshal.unmarshal(Outer, data).inner.name
+
+
+@dataclass
+class Primitives:
+    ids: typing.List[int]
+    labels: typing.Dict[str, str]
+    values: typing.List[Flat]
+
+
+_PRIMITIVES = Primitives(list(range(10000)), {f'key_{i}': f'value_{i}' for i in range(1000)},
+                         [Flat(f'flat_{i}', i, i / 2, True) for i in range(1000)])
+
+
+def _register_trusted():
+    blob = Marshal.marshal(_PRIMITIVES)
+    for name, options in (('unmarshal', {}), ('unmarshal_trusted', {'trusted': True}),
+                          ('unmarshal_codegen_trusted', {'trusted': True, 'codegen': True})):
+        def setup(options=options):
+            marshal = Marshal(**options)
+            return lambda: marshal.unmarshal_str(Primitives, blob)
+        benchmark(f'{name}/primitives')(setup)
+
+
+_register_trusted()
+
+_CODECS = {
+    'json': {},
+    'json_positional': {'positional': True},
+    'msgpack': {'codec': 'msgpack'},
+    'msgpack_positional': {'codec': 'msgpack', 'positional': True},
+    'cbor': {'codec': 'cbor'},
+    'cbor_positional': {'codec': 'cbor', 'positional': True},
+}
+
+_CODEC_MODULES = {'json': 'orjson', 'msgpack': 'msgpack', 'cbor': 'cbor2'}
+
+
+def _codec_marshals() -> dict:
+    marshals = {}
+    for name, options in _CODECS.items():
+        if importlib.util.find_spec(_CODEC_MODULES[options.get('codec', 'json')]) is not None:
+            marshals[name] = Marshal(**options)
+    return marshals
+
+
+def _register_codecs():
+    for name, marshal in _codec_marshals().items():
+        for scenario in ('nested_list', 'wide_dict', 'datetime'):
+            cls, obj = _SCENARIOS[scenario]
+            blob = marshal.marshal(obj)
+
+            def unmarshal(marshal=marshal, cls=cls, blob=blob):
+                return lambda: marshal.unmarshal_str(cls, blob)
+
+            def marshal_(marshal=marshal, obj=obj):
+                return lambda: marshal.marshal(obj)
+
+            benchmark(f'unmarshal_{name}/{scenario}')(unmarshal)
+            benchmark(f'marshal_{name}/{scenario}')(marshal_)
+
+
+_register_codecs()
+
+
+def _register_cached():
+    for scenario in ('flat', 'nested_list', 'wide_dict'):
+        cls, obj = _SCENARIOS[scenario]
+        blob = Marshal.marshal(obj)
+        for mode in ('share', 'copy'):
+            def setup(cls=cls, blob=blob, mode=mode):
+                marshal = Marshal()
+                marshal.enable_cache(mode=mode)
+                return lambda: marshal.unmarshal_str(cls, blob)
+            benchmark(f'unmarshal_cached_{mode}/{scenario}')(setup)
+
+
+_register_cached()
+
+
+def print_sizes():
+    marshals = _codec_marshals()
+    print(f'{"scenario":<15}' + ''.join(f'{name:>20}' for name in marshals))
+    for scenario, (cls, obj) in _SCENARIOS.items():
+        print(f'{scenario:<15}' + ''.join(f'{len(marshal.marshal(obj)):>20}' for marshal in marshals.values()))
+
+
+@benchmark('baseline_json/flat')
+def _baseline_flat():
+    blob = json.dumps({'name': 'flat', 'value': 1, 'ratio': 0.5, 'enabled': True})
+
+    def run():
+        data = json.loads(blob)
+        return Flat(str(data['name']), int(data['value']), float(data['ratio']), bool(data['enabled']))
+    return run
+
+
+@benchmark('baseline_json/nested_list')
+def _baseline_nested_list():
+    blob = Marshal.marshal(_SCENARIOS['nested_list'][1]).decode()
+
+    def run():
+        data = json.loads(blob)
+        return Outer(Inner(data['inner']['name'], data['inner']['value']),
+                     [Inner(str(x['name']), int(x['value'])) for x in data['inner_list']])
+    return run
+
+
+@benchmark('baseline_json/wide_dict')
+def _baseline_wide_dict():
+    blob = Marshal.marshal(_SCENARIOS['wide_dict'][1]).decode()
+
+    def run():
+        data = json.loads(blob)
+        return WideDict({str(k): Inner(str(v['name']), int(v['value'])) for k, v in data['values'].items()})
+    return run
+
+
+@benchmark('baseline_json/datetime')
+def _baseline_datetime():
+    blob = Marshal.marshal(_SCENARIOS['datetime'][1]).decode()
+
+    def run():
+        data = json.loads(blob)
+        return Event(datetime.datetime.fromisoformat(data['created']), datetime.datetime.fromisoformat(data['updated']))
+    return run
+
+
+@benchmark('baseline_json/marshal_nested_list')
+def _baseline_marshal_nested_list():
+    obj = _SCENARIOS['nested_list'][1]
+
+    def run():
+        return json.dumps({'inner': {'name': obj.inner.name, 'value': obj.inner.value},
+                           'inner_list': [{'name': x.name, 'value': x.value} for x in obj.inner_list]})
+    return run
+
+
+def run_benchmark(setup, repeat: int, min_time: float) -> dict:
+    func = setup()
+    func()
+    number, elapsed = timeit.Timer(func).autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timeit.timeit(func, number=number)
+    timings = [t / number for t in timeit.repeat(func, number=number, repeat=repeat)]
+    return {
+        'loops': number,
+        'min': min(timings),
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0
+    }
+
+
+def _format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.3f} {unit}'
+    return f'{seconds / 1e-9:.1f} ns'
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='', help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed repetitions per benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimum seconds per repetition')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+    parser.add_argument('--compare', help='Results file from an earlier run to compare against')
+    parser.add_argument('--sizes', action='store_true', help='Print the encoded size of each scenario per codec')
+    args = parser.parse_args(argv)
+
+    if args.sizes:
+        print_sizes()
+        return 0
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['benchmarks']
+
+    results = {}
+    for name, setup in _BENCHMARKS:
+        if args.filter not in name:
+            continue
+        result = run_benchmark(setup, args.repeat, args.min_time)
+        results[name] = result
+        line = f'{name:<45} {_format_time(result["mean"]):>12} +- {_format_time(result["stdev"]):>12}'
+        if name in previous:
+            line += f'  {result["mean"] / previous[name]["mean"]:6.2f}x'
+        print(line)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'pymarshaler': pymarshaler.__version__,
+                'python': sys.version,
+                'platform': platform.platform(),
+                'benchmarks': results
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,13 @@
 __version__ = '0.4.2'
-__all__ = ['Marshal', 'utils', 'arg_delegates', 'errors']
+__all__ = ['Marshal', 'utils', 'arg_delegates', 'cache', 'codecs', 'dedup', 'errors', 'streaming', 'stats', 'unions']
 
 from pymarshaler import arg_delegates
+from pymarshaler import cache
+from pymarshaler import codecs
+from pymarshaler import dedup
 from pymarshaler import errors
+from pymarshaler import stats
+from pymarshaler import streaming
+from pymarshaler import unions
 from pymarshaler import utils
 from pymarshaler.marshal import Marshal
@@ -1,7 +1,13 @@
-import dateutil.parser as parser
+import array
+import base64
+import collections.abc
+import datetime
+import inspect
+import typing
+from enum import Enum
 
-from pymarshaler.errors import UnknownFieldError
-from pymarshaler.utils import get_init_params
+from pymarshaler.errors import MissingFieldsError, UnknownFieldError, PymarshalError
+from pymarshaler.utils import get_init_params, get_origin, get_args
 
 
 def enum_delegate(cls, data, ignore_func):
@@ -12,37 +18,27 @@ def enum_delegate(cls, data, ignore_func):
 
 
 def list_delegate(cls, data, func):
-    inner_type = cls.__args__[0]
-    return [func(inner_type, x) for x in data]
+    return compile_list_delegate(cls, _eager(func))(data)
 
 
 def set_delegate(cls, data, func):
-    inner_type = cls.__args__[0]
-    return {func(inner_type, x) for x in data}
+    return compile_set_delegate(cls, _eager(func))(data)
 
 
 def tuple_delegate(cls, data, func):
-    inner_type = cls.__args__[0]
-    return func(inner_type, data[0]), func(inner_type, data[1])
+    return compile_tuple_delegate(cls, _eager(func))(data)
 
 
 def dict_delegate(cls, data, func):
-    key_type = cls.__args__[0]
-    value_type = cls.__args__[1]
-    return {
-        func(key_type, key): func(value_type, value) for key, value in data.items()
-    }
+    return compile_dict_delegate(cls, _eager(func))(data)
 
 
 def builtin_delegate(cls, data, ignore_func):
-    if data is None:
-        return None
-    else:
-        return cls(data)
+    return compile_builtin_delegate(cls)(data)
 
 
 def datetime_delegate(cls_ignore, data, ignore_func=None):
-    return parser.parse(data)
+    return compile_datetime_delegate(datetime.datetime, DATETIME_DATEUTIL)(data)
 
 
 def user_defined_delegate(cls, data, func, ignore_unknown_fields: bool, walk_unknown_fields: bool):
@@ -64,3 +60,454 @@ def user_defined_delegate(cls, data, func, ignore_unknown_fields: bool, walk_unk
                     if isinstance(x, dict):
                         args.update(user_defined_delegate(cls, x, func, ignore_unknown_fields, walk_unknown_fields))
     return args
+
+
+def _eager(func):
+    """
+    Adapt a `func(cls, data)` decoding function to the `compile_func(cls)` form the compile_* delegates expect
+    """
+    def compile_func(cls):
+        def convert(data):
+            return func(cls, data)
+        return convert
+    return compile_func
+
+
+def compile_enum_delegate(cls, by_name: bool = False, case_insensitive: bool = False):
+    """
+    Build the decoder for an enum backed by a lookup table instead of a scan over its members
+    :param cls: The enum class
+    :param by_name: If True values are decoded from member names, otherwise from member values
+    :param case_insensitive: If True string names/values are matched ignoring case
+    :return: The decoder
+    """
+    if by_name:
+        lookup = dict(cls.__members__)
+    else:
+        # _value2member_map_ only holds hashable values, anything else is found by the scan in enum_delegate
+        lookup = dict(getattr(cls, '_value2member_map_', {}))
+    if case_insensitive:
+        for key, member in list(lookup.items()):
+            if isinstance(key, str):
+                lookup.setdefault(key.casefold(), member)
+
+    def delegate(data):
+        try:
+            return lookup[data]
+        except KeyError:
+            if case_insensitive and isinstance(data, str) and data.casefold() in lookup:
+                return lookup[data.casefold()]
+        except TypeError:
+            pass
+        if by_name:
+            raise UnknownFieldError(f'Invalid name {data} for enum {cls.__name__}')
+        return enum_delegate(cls, data, None)
+    return delegate
+
+
+JSON_TYPES = (type(None), bool, int, float, str, list, dict)
+
+
+def any_delegate(data):
+    return data
+
+
+def none_delegate(data):
+    return None
+
+
+def compile_list_delegate(cls, compile_func):
+    convert = compile_func(_arg(cls, 0))
+    container = _concrete(get_origin(cls), list)
+
+    if container is list:
+        def delegate(data):
+            return [convert(x) for x in data]
+    else:
+        def delegate(data):
+            return container([convert(x) for x in data])
+    return delegate
+
+
+PRIMITIVE_TYPES = (str, int, float, bool)
+
+
+def is_primitive_container(cls) -> bool:
+    """
+    Returns whether `cls` is a list or dict (or an abstract collection decoded to one) of primitives, e.g. `List[int]`
+    or `Dict[str, str]`, which trusted input may hold as is
+    """
+    origin = get_origin(cls)
+    args = get_args(cls)
+    if not args or not all(arg in PRIMITIVE_TYPES or arg is typing.Any for arg in args):
+        return False
+    if not inspect.isclass(origin):
+        return False
+    if issubclass(origin, collections.abc.Sequence) and _concrete(origin, list) is list:
+        return len(args) == 1
+    return issubclass(origin, collections.abc.Mapping) and _concrete(origin, dict) is dict and len(args) == 2
+
+
+def compile_trusted_container_delegate(cls, fallback):
+    """
+    Build the decoder for a list or dict of primitives (see `is_primitive_container`) from trusted input. When the
+    data already holds exactly the annotated types it is returned as is, after a type check of its items which runs at
+    C speed, otherwise it is rebuilt by `fallback`
+    :param cls: The container type
+    :param fallback: The regular decoder of `cls`
+    :return: The decoder
+    """
+    args = get_args(cls)
+    if len(args) == 1:
+        items = None if args[0] is typing.Any else {args[0]}
+
+        def delegate(data):
+            if data.__class__ is list and (items is None or items.issuperset(map(type, data))):
+                return data
+            return fallback(data)
+        return delegate
+
+    keys = None if args[0] is typing.Any else {args[0]}
+    values = None if args[1] is typing.Any else {args[1]}
+
+    def delegate(data):
+        if data.__class__ is dict and (keys is None or keys.issuperset(map(type, data))) \
+                and (values is None or values.issuperset(map(type, data.values()))):
+            return data
+        return fallback(data)
+    return delegate
+
+
+def compile_set_delegate(cls, compile_func):
+    convert = compile_func(_arg(cls, 0))
+    container = _concrete(get_origin(cls), set)
+
+    if container is set:
+        def delegate(data):
+            return {convert(x) for x in data}
+    else:
+        def delegate(data):
+            return container(convert(x) for x in data)
+    return delegate
+
+
+def compile_tuple_delegate(cls, compile_func):
+    """
+    Build the decoder for `Tuple[X, ...]` (any length) and `Tuple[X, Y, Z]` (fixed length) annotations. For backwards
+    compatibility `Tuple[X]` also accepts any number of items
+    """
+    args = getattr(cls, '__args__', None)
+    if args in ((), ((),)):
+        # Tuple[()], the empty tuple
+        return lambda data: ()
+    if not args or (len(args) == 2 and args[1] is Ellipsis):
+        convert = compile_func(_arg(cls, 0))
+
+        def delegate(data):
+            return tuple([convert(x) for x in data])
+        return delegate
+
+    converters = [compile_func(arg) for arg in args]
+    single = converters[0] if len(converters) == 1 else None
+
+    def delegate(data):
+        if len(data) != len(converters):
+            if single is not None:
+                return tuple([single(x) for x in data])
+            raise ValueError(f'Expected {len(converters)} items for {cls}, got {len(data)}')
+        return tuple([convert(x) for convert, x in zip(converters, data)])
+    return delegate
+
+
+def compile_dict_delegate(cls, compile_func):
+    convert_key = compile_func(_arg(cls, 0))
+    convert_value = compile_func(_arg(cls, 1))
+    container = _concrete(get_origin(cls), dict)
+
+    if container is dict:
+        def delegate(data):
+            return {convert_key(key): convert_value(value) for key, value in data.items()}
+    else:
+        def delegate(data):
+            return container({convert_key(key): convert_value(value) for key, value in data.items()})
+    return delegate
+
+
+def compile_union_delegate(cls, compile_func, json_types_func):
+    """
+    Build the decoder for a `Union` (or `Optional`). The members able to decode each JSON type are worked out once,
+    so decoding only has to try several members when more than one of them accepts the JSON type of the data
+    :param cls: The union type
+    :param compile_func: Callable returning the compiled converter for a type
+    :param json_types_func: Callable returning the JSON types (as python types) a type can be decoded from,
+    or None if it may accept any of them
+    :return: The decoder
+    """
+    candidates = {json_type: [] for json_type in JSON_TYPES}
+    converters = []
+    for member in get_args(cls):
+        convert = none_delegate if member is type(None) else compile_func(member)
+        converters.append(convert)
+        accepted = json_types_func(member)
+        for json_type in JSON_TYPES if accepted is None else accepted:
+            candidates[json_type].append(convert)
+
+    table = {
+        json_type: members[0] if len(members) == 1 else _first_success(cls, members)
+        for json_type, members in candidates.items() if members
+    }
+    # Data which isn't plain JSON, e.g. decoded by another wire format, tries every member
+    fallback = _first_success(cls, converters)
+
+    def delegate(data):
+        convert = table.get(data.__class__)
+        if convert is not None:
+            return convert(data)
+        if data.__class__ in candidates:
+            raise UnknownFieldError(f'Invalid value {data} for {cls}')
+        return fallback(data)
+    return delegate
+
+
+def compile_tagged_union_delegate(cls, field: str, index: dict, decoder_for, reindex=None):
+    """
+    Build the decoder for a tagged union base class. The tag held in `field` selects the concrete class through the
+    precomputed `index`, so decoding never has to try each subclass in turn. Positionally encoded values are arrays
+    holding the tag followed by the field values
+    :param cls: The declared (base) class
+    :param field: Name of the discriminator field
+    :param index: Mapping of tag to concrete class
+    :param decoder_for: Callable returning the decoder building exactly the given class from its fields
+    :param reindex: Callable returning an up to date index, called once before rejecting an unknown tag so subclasses
+    defined after the decoder was built are found. None when the index can't change
+    :return: The decoder
+    """
+    decoders = {}
+
+    def delegate(data):
+        if data.__class__ is list:
+            # Positional encoding, the tag comes before the field values
+            if not data:
+                raise MissingFieldsError(f'Missing tag required to decode {cls.__name__}')
+            tag, data = data[0], data[1:]
+        else:
+            try:
+                tag = data[field]
+            except KeyError:
+                if cls in index.values():
+                    return decoder_for(cls)(data)
+                raise MissingFieldsError(f'Missing tag field {field!r} required to decode {cls.__name__}')
+            except TypeError:
+                raise UnknownFieldError(f'Invalid value {data} for {cls.__name__}')
+        try:
+            decode = decoders[tag]
+        except (KeyError, TypeError):
+            decode = decoders[tag] = decoder_for(klass_for(tag))
+        return decode(data)
+
+    def klass_for(tag):
+        nonlocal index
+        if tag.__class__ not in (str, int):
+            raise UnknownFieldError(f'Unknown {field!r} tag {tag!r} for {cls.__name__}')
+        if tag not in index and reindex is not None:
+            index = reindex()
+        if tag not in index:
+            raise UnknownFieldError(f'Unknown {field!r} tag {tag!r} for {cls.__name__}')
+        return index[tag]
+    return delegate
+
+
+def compile_positional_delegate(cls, fields: dict, decode_mapping):
+    """
+    Build a decoder accepting either an object keyed by field name or an array of the field values in order, as
+    written for NamedTuples and by the positional encoding
+    :param cls: The class type
+    :param fields: The converter of each field, in order
+    :param decode_mapping: The decoder used for objects
+    :return: The decoder
+    """
+    names = list(fields)
+    converters = list(fields.values())
+
+    def delegate(data):
+        if not isinstance(data, (list, tuple)):
+            return decode_mapping(data)
+        if len(data) > len(converters):
+            raise UnknownFieldError(f'Expected at most {len(converters)} values for {cls.__name__}, got {len(data)}')
+        try:
+            return cls(**{name: convert(value) for name, convert, value in zip(names, converters, data)})
+        except TypeError as e:
+            raise MissingFieldsError(f'Missing required field(s) of {cls.__name__}: {e}')
+    return delegate
+
+
+def compile_bytes_delegate(cls):
+    """
+    Build the decoder for bytes, which binary codecs load natively and JSON holds as base64 strings
+    """
+    def delegate(data):
+        if data is None:
+            return None
+        if isinstance(data, str):
+            return cls(base64.b64decode(data))
+        return data if data.__class__ is cls else cls(data)
+    return delegate
+
+
+NUMERIC_ARRAY = 'array'
+NUMERIC_NUMPY = 'numpy'
+NUMERIC_LISTS = (None, NUMERIC_ARRAY, NUMERIC_NUMPY)
+
+
+def is_numeric_list(cls) -> bool:
+    """
+    Returns whether `cls` is `List[int]` or `List[float]`, which may be decoded to a compact array
+    """
+    return get_origin(cls) is list and get_args(cls) in ((int,), (float,))
+
+
+def compile_numeric_array_delegate(cls, numeric_lists: str):
+    """
+    Build the decoder for `List[int]` or `List[float]` producing an `array.array` ('q' or 'd' typecode) or a numpy
+    array (int64 or float64), which store the numbers unboxed
+    :param cls: `List[int]` or `List[float]`
+    :param numeric_lists: NUMERIC_ARRAY or NUMERIC_NUMPY
+    :return: The decoder
+    """
+    item = get_args(cls)[0]
+    if numeric_lists == NUMERIC_NUMPY:
+        import numpy
+        dtype = numpy.int64 if item is int else numpy.float64
+
+        def delegate(data):
+            return None if data is None else numpy.array(data, dtype=dtype)
+        return delegate
+
+    typecode = 'q' if item is int else 'd'
+
+    def delegate(data):
+        if data is None:
+            return None
+        try:
+            return array.array(typecode, data)
+        except TypeError:
+            # e.g. floats in a List[int], coerced like the list decoder would
+            return array.array(typecode, [item(x) for x in data])
+        except OverflowError:
+            # Integers which don't fit in 64 bits stay a list
+            return [item(x) for x in data]
+    return delegate
+
+
+def compile_literal_delegate(cls):
+    allowed = {}
+    for value in get_args(cls):
+        allowed[(value.__class__, value)] = value
+        if isinstance(value, Enum):
+            allowed[(value.value.__class__, value.value)] = value
+
+    def delegate(data):
+        try:
+            return allowed[(data.__class__, data)]
+        except (KeyError, TypeError):
+            raise UnknownFieldError(f'Invalid value {data} for {cls}')
+    return delegate
+
+
+def _first_success(cls, converters):
+    def delegate(data):
+        for convert in converters:
+            try:
+                return convert(data)
+            except (PymarshalError, ValueError, TypeError, KeyError, AttributeError):
+                pass
+        raise UnknownFieldError(f'Invalid value {data} for {cls}')
+    return delegate
+
+
+def _arg(cls, index: int):
+    args = get_args(cls)
+    if len(args) > index and not isinstance(args[index], typing.TypeVar):
+        return args[index]
+    return typing.Any
+
+
+def _concrete(origin, default):
+    if origin is None or inspect.isabstract(origin) or origin.__module__ in ('collections.abc', 'typing'):
+        return default
+    return origin
+
+
+def compile_builtin_delegate(cls, trusted: bool = False):
+    if trusted and cls in PRIMITIVE_TYPES:
+        def delegate(data):
+            if data.__class__ is cls or data is None:
+                return data
+            return cls(data)
+        return delegate
+
+    def delegate(data):
+        if data is None:
+            return None
+        return cls(data)
+    return delegate
+
+
+DATETIME_ISO = 'iso'
+DATETIME_EPOCH = 'epoch'
+DATETIME_EPOCH_MILLIS = 'epoch_millis'
+DATETIME_DATEUTIL = 'dateutil'
+DATETIME_FORMATS = (DATETIME_ISO, DATETIME_EPOCH, DATETIME_EPOCH_MILLIS, DATETIME_DATEUTIL)
+
+
+def is_valid_datetime_format(datetime_format: str) -> bool:
+    return datetime_format in DATETIME_FORMATS or '%' in datetime_format
+
+
+def parse_iso_datetime(data: str) -> datetime.datetime:
+    try:
+        return datetime.datetime.fromisoformat(data)
+    except ValueError:
+        # Python < 3.11 doesn't accept the UTC designator
+        if data[-1:] in ('Z', 'z'):
+            return datetime.datetime.fromisoformat(data[:-1] + '+00:00')
+        raise
+
+
+def compile_datetime_delegate(cls, datetime_format: str = DATETIME_ISO):
+    """
+    Build the decoder for `datetime.datetime`, `datetime.date`, `datetime.time` and `datetime.timedelta` values
+    :param cls: One of the datetime module types, or a subclass
+    :param datetime_format: 'iso', 'epoch' (seconds), 'epoch_millis', 'dateutil' or a `strptime` format.
+    Only datetimes follow the format, dates and times are always ISO 8601 and timedeltas are always seconds
+    :return: The decoder
+    """
+    if issubclass(cls, datetime.datetime):
+        if datetime_format == DATETIME_ISO:
+            parse = parse_iso_datetime
+        elif datetime_format == DATETIME_EPOCH:
+            def parse(data):
+                return datetime.datetime.fromtimestamp(data, tz=datetime.timezone.utc)
+        elif datetime_format == DATETIME_EPOCH_MILLIS:
+            def parse(data):
+                return datetime.datetime.fromtimestamp(data / 1000, tz=datetime.timezone.utc)
+        elif datetime_format == DATETIME_DATEUTIL:
+            import dateutil.parser
+            parse = dateutil.parser.parse
+        else:
+            def parse(data):
+                return datetime.datetime.strptime(data, datetime_format)
+    elif issubclass(cls, datetime.date):
+        parse = datetime.date.fromisoformat
+    elif issubclass(cls, datetime.time):
+        parse = datetime.time.fromisoformat
+    else:
+        def parse(data):
+            return datetime.timedelta(seconds=data)
+
+    def delegate(data):
+        if isinstance(data, (str, int, float)):
+            return parse(data)
+        # Already decoded, e.g. by a wire format with native datetimes
+        return data
+    return delegate
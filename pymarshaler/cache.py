@@ -0,0 +1,261 @@
+import collections
+import copy
+import dataclasses
+import datetime
+import enum
+import hashlib
+import threading
+import time
+import typing
+
+from pymarshaler.utils import get_origin, get_args
+
+# Return the cached instance itself when the target class is deeply immutable, a copy (see clone) otherwise
+CACHE_AUTO = 'auto'
+# Always return the cached instance. Callers must not mutate what they get back
+CACHE_SHARE = 'share'
+# Always return a copy of the cached instance
+CACHE_COPY = 'copy'
+
+CACHE_MODES = (CACHE_AUTO, CACHE_SHARE, CACHE_COPY)
+
+_Literal = getattr(typing, 'Literal', None)
+
+_SHARED_TYPES = {str, int, float, bool, bytes, type(None), datetime.date, datetime.datetime, datetime.time,
+                 datetime.timedelta, frozenset}
+
+# The cloner of each class seen by clone, None for classes which aren't copied through their __dict__
+_CLONERS = {}
+_UNSEEN = object()
+
+
+def clone(value):
+    """
+    Copy a decoded value, sharing its immutable parts. Lists, dicts, sets and plain objects are rebuilt, anything else
+    falls back to `copy.deepcopy`. Dataclass fields annotated with immutable types, such as `str` or `Optional[int]`,
+    are shared without being looked at, so copying a tree of objects costs a fraction of decoding it again
+    """
+    cls = value.__class__
+    if cls in _SHARED_TYPES:
+        return value
+    cloner = _CLONERS.get(cls, _UNSEEN)
+    if cloner is _UNSEEN:
+        cloner = _CLONERS[cls] = _compile_cloner(cls)
+    if cloner is not None:
+        return cloner(value)
+    if cls is list:
+        # Calls the cloner of each item directly once known, the items of a list usually share their class
+        cloner_for = _CLONERS.get
+        return [item if item.__class__ in _SHARED_TYPES else (cloner_for(item.__class__) or clone)(item)
+                for item in value]
+    if cls is dict:
+        return _clone_items(value.copy())
+    if cls is set:
+        return {clone(item) for item in value}
+    if isinstance(value, enum.Enum):
+        return value
+    return copy.deepcopy(value)
+
+
+def _clone_items(copied: dict) -> dict:
+    shared = _SHARED_TYPES
+    for key, item in copied.items():
+        if item.__class__ not in shared:
+            copied[key] = clone(item)
+    return copied
+
+
+def _compile_cloner(cls) -> typing.Optional[typing.Callable[[typing.Any], typing.Any]]:
+    # Instances must be built by object.__new__ and fully described by their __dict__
+    if cls.__new__ is not object.__new__ or hasattr(cls, '__slots__') or hasattr(cls, '__deepcopy__') \
+            or cls.__reduce_ex__ is not object.__reduce_ex__:
+        return None
+    new = object.__new__
+    set_state = object.__setattr__
+    names = [f.name for f in dataclasses.fields(cls)] if dataclasses.is_dataclass(cls) else None
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:
+        names = None
+    if names is None:
+        return _clone_state
+
+    # Only the fields which may hold mutable values are looked at, as long as the instance holds nothing but its fields
+    count = len(names)
+    mutable = [name for name in names if not _is_immutable_type(hints.get(name))]
+    shared = _SHARED_TYPES
+    fields = dataclasses.fields(cls)
+    if cls.__dataclass_params__.init and all(f.init for f in fields) and not hasattr(cls, '__post_init__') and \
+            all(name.isidentifier() for name in names):
+        return _compile_init_cloner(cls, fields, mutable, count)
+
+    def cloner(value):
+        state = value.__dict__.copy()
+        if len(state) != count:
+            _clone_items(state)
+        else:
+            for name in mutable:
+                item = state[name]
+                if item.__class__ not in shared:
+                    state[name] = clone(item)
+        copied = new(cls)
+        # Bypasses the __setattr__ of frozen dataclasses
+        set_state(copied, '__dict__', state)
+        return copied
+    return cloner
+
+
+def _compile_init_cloner(cls, fields: tuple, mutable: list, count: int):
+    """
+    Generate a cloner calling the dataclass' __init__ with the fields of the original, straight line
+    """
+    args = []
+    for f in fields:
+        arg = f'__copy(value.{f.name})' if f.name in mutable else f'value.{f.name}'
+        args.append(f'{f.name}={arg}' if getattr(f, 'kw_only', False) else arg)
+    args = ', '.join(args)
+    source = (
+        'def cloner(value):\n'
+        '    if len(value.__dict__) != __count:\n'
+        '        return __fallback(value)\n'
+        f'    return __cls({args})\n'
+    )
+    namespace = {'__cls': cls, '__count': count, '__copy': _copy_field, '__fallback': _clone_state}
+    exec(source, namespace)
+    return namespace['cloner']
+
+
+def _copy_field(item):
+    return item if item.__class__ in _SHARED_TYPES else clone(item)
+
+
+def _clone_state(value):
+    copied = object.__new__(value.__class__)
+    object.__setattr__(copied, '__dict__', _clone_items(value.__dict__.copy()))
+    return copied
+
+
+def _is_immutable_type(tp) -> bool:
+    if tp in _SHARED_TYPES:
+        return True
+    if hasattr(tp, '__metadata__'):
+        return _is_immutable_type(tp.__origin__)
+    origin = get_origin(tp)
+    if origin is not None and origin is _Literal:
+        return True
+    if origin is typing.Union:
+        return all(_is_immutable_type(arg) for arg in get_args(tp))
+    return isinstance(tp, type) and issubclass(tp, enum.Enum)
+
+
+class _Entry:
+
+    __slots__ = ('value', 'size', 'expires')
+
+    def __init__(self, value, size: int, expires: typing.Optional[float]):
+        self.value = value
+        self.size = size
+        self.expires = expires
+
+
+class ResultCache:
+    """
+    Cache of decoded instances keyed by target class and a hash of the raw payload, so unmarshaling bytes seen before
+    skips parsing and decoding. Entries are evicted least recently used first once the cache holds `max_entries`
+    entries or `max_bytes` bytes of payload, and expire `ttl` seconds after they were decoded. See
+    `Marshal.enable_cache`
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: typing.Optional[int] = None,
+                 ttl: typing.Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def lookup(self, cls, data, decode: typing.Callable[[typing.Any, typing.Any], typing.Any], share: bool):
+        """
+        Return the cached instance of `cls` for the payload `data`, decoding and caching it on a miss
+        :param cls: The class type
+        :param data: The raw payload, a str or any bytes-like object
+        :param decode: Called with `cls` and `data` on a miss
+        :param share: Whether to return the cached instance itself rather than a copy, see `clone`
+        :return: An instance of the class `cls`
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        key = (cls, hashlib.blake2b(data, digest_size=16).digest())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires <= now:
+                self._remove(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self._hits += 1
+        if entry is not None:
+            value = entry.value
+        else:
+            value = decode(cls, data)
+            self._store(key, value, data.nbytes if isinstance(data, memoryview) else len(data), now)
+        return value if share else clone(value)
+
+    def _store(self, key, value, size: int, now: float):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = None if self.ttl is None else now + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, size, expires)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key).size
+
+    def clear(self):
+        """
+        Drop every entry, keeping the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def as_dict(self) -> dict:
+        """
+        Export the cache counters as plain data, e.g. to size the cache
+        :return: A dict of the hit and miss counts, hit rate, evictions, expirations and current size
+
+        Example:
+
+        >>> cache = marshal.enable_cache(max_entries=128)
+        >>> marshal.unmarshal_str(Test, data)
+        >>> marshal.unmarshal_str(Test, data)
+        >>> print(cache.as_dict())
+        {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'evictions': 0, 'expirations': 0, 'entries': 1, 'bytes': 15}
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
@@ -0,0 +1,152 @@
+import abc
+import datetime
+import mmap
+import os
+import typing
+
+import orjson
+
+from pymarshaler.errors import PymarshalError
+
+CODEC_JSON = 'json'
+CODEC_MSGPACK = 'msgpack'
+CODEC_CBOR = 'cbor'
+
+
+class Codec(abc.ABC):
+    """
+    A wire format sitting behind a Marshal. The Marshal turns objects into the format's native types through the
+    `default` hook and decodes the native types the codec loads, so a codec only deals with serialization
+    """
+
+    name = None
+    # Whether bytes are written natively, otherwise the Marshal writes them as base64 strings
+    native_bytes = True
+
+    @abc.abstractmethod
+    def dumps(self, obj, default: typing.Callable[[typing.Any], typing.Any], option: int = 0) -> bytes:
+        """
+        Serialize `obj`, calling `default` for every object the format can't write natively
+        :param obj: The object to serialize
+        :param default: Hook converting an unsupported object into supported ones
+        :param option: orjson option flags, only meaningful to the JSON codec
+        :return: The serialized bytes
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def loads(self, data) -> typing.Any:
+        """
+        Deserialize a bytes-like object into native types
+        """
+        raise NotImplementedError
+
+    def load_file(self, path) -> typing.Any:
+        """
+        Deserialize the content of the file at `path` straight from a read only memory map of the file
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return self.loads(b'')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                return self.loads(view)
+
+
+class JsonCodec(Codec):
+    """
+    JSON through orjson. Datetimes are written natively as ISO 8601 strings, bytes as base64 strings
+    """
+
+    name = CODEC_JSON
+    native_bytes = False
+
+    def dumps(self, obj, default, option: int = 0) -> bytes:
+        return orjson.dumps(obj, default=default, option=option)
+
+    def loads(self, data) -> typing.Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """
+    MessagePack through the `msgpack` package. Bytes are written as bin and datetimes as timestamps, naive datetimes
+    being taken to be UTC. Decoded datetimes are timezone aware (UTC)
+    """
+
+    name = CODEC_MSGPACK
+
+    def __init__(self):
+        msgpack = _import(CODEC_MSGPACK, 'msgpack')
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+        self._timestamp = msgpack.Timestamp
+
+    def dumps(self, obj, default, option: int = 0) -> bytes:
+        timestamp = self._timestamp
+
+        def hook(o):
+            if isinstance(o, datetime.datetime):
+                return timestamp.from_datetime(_aware(o))
+            return default(o)
+        return self._packb(obj, default=hook, use_bin_type=True, datetime=False)
+
+    def loads(self, data) -> typing.Any:
+        return self._unpackb(data, raw=False, timestamp=3, strict_map_key=False)
+
+
+class CborCodec(Codec):
+    """
+    CBOR through the `cbor2` package. Bytes, sets and datetimes are written natively, naive datetimes being taken to
+    be UTC
+    """
+
+    name = CODEC_CBOR
+
+    def __init__(self):
+        cbor2 = _import(CODEC_CBOR, 'cbor2')
+        self._dumps = cbor2.dumps
+        self._loads = cbor2.loads
+
+    def dumps(self, obj, default, option: int = 0) -> bytes:
+        def hook(encoder, o):
+            encoder.encode(default(o))
+        return self._dumps(obj, default=hook, timezone=datetime.timezone.utc)
+
+    def loads(self, data) -> typing.Any:
+        return self._loads(data)
+
+
+CODECS = {
+    CODEC_JSON: JsonCodec,
+    CODEC_MSGPACK: MsgpackCodec,
+    CODEC_CBOR: CborCodec
+}
+
+
+def register_codec(name: str, factory: typing.Callable[[], Codec]):
+    """
+    Make a custom codec available to `Marshal(codec=name)`
+    :param name: The codec name
+    :param factory: Callable building the codec, e.g. the Codec subclass
+    :return: None
+    """
+    CODECS[name] = factory
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        factory = CODECS[name]
+    except KeyError:
+        raise PymarshalError(f'Unknown codec {name}, expected one of {list(CODECS)}')
+    return factory()
+
+
+def _import(codec: str, module: str):
+    try:
+        return __import__(module)
+    except ImportError:
+        raise PymarshalError(f'The {codec} codec requires the {module} package to be installed')
+
+
+def _aware(o: datetime.datetime) -> datetime.datetime:
+    return o if o.tzinfo is not None else o.replace(tzinfo=datetime.timezone.utc)
@@ -0,0 +1,104 @@
+import linecache
+import typing
+
+from pymarshaler.utils import get_origin, get_args
+
+_SCALARS = (str, int, float, bool)
+_MISSING = object()
+
+
+class _DecoderBuilder:
+
+    def __init__(self, plan, converter_for, can_inline, trusted: bool = False):
+        self._plan = plan
+        self._converter_for = converter_for
+        self._can_inline = can_inline
+        self._trusted = trusted
+        self._namespace = {'__plan': plan, '__cls': plan.cls, '__MISSING': _MISSING}
+        self._counter = 0
+
+    def build(self) -> typing.Callable[[dict], typing.Any]:
+        plan = self._plan
+        lines = ['def __decode(data):']
+        if plan.walk_unknown_fields:
+            self._namespace['__known'] = frozenset(plan.fields) | plan.extra_keys
+            lines.append('    if not data.keys() <= __known:')
+            lines.append('        return __plan.decode(data)')
+        lines.append('    __get = data.get')
+        lines.append('    __kw = {}')
+        lines.append('    __found = 0')
+        required = set(plan.required)
+        for name, param_type in plan.types.items():
+            value = self._expr(param_type, '__v', plan.fields[name], 0)
+            lines.append(f'    __v = __get({name!r}, __MISSING)')
+            if name in required:
+                lines.append('    if __v is __MISSING:')
+                lines.append('        return __plan.decode(data)')
+                lines.append(f'    __kw[{name!r}] = {value}')
+                lines.append('    __found += 1')
+            else:
+                lines.append('    if __v is not __MISSING:')
+                lines.append(f'        __kw[{name!r}] = {value}')
+                lines.append('        __found += 1')
+        if not plan.ignore_unknown_fields:
+            for name in plan.extra_keys:
+                lines.append(f'    __found += {name!r} in data')
+            lines.append('    if __found != len(data):')
+            lines.append('        return __plan.decode(data)')
+        lines.append('    return __cls(**__kw)')
+        source = '\n'.join(lines) + '\n'
+
+        filename = f'<pymarshaler decoder {plan.cls.__module__}.{plan.cls.__qualname__}>'
+        exec(compile(source, filename, 'exec'), self._namespace)
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        decode = self._namespace['__decode']
+        decode.__name__ = decode.__qualname__ = f'decode_{plan.cls.__name__}'
+        return decode
+
+    def _expr(self, tp, var: str, converter, depth: int) -> str:
+        """
+        Source expression converting the raw value held in `var` to `tp`
+        """
+        if self._can_inline(tp):
+            if tp is typing.Any:
+                return var
+            if tp in _SCALARS:
+                if self._trusted:
+                    return f'({var} if {var}.__class__ is {tp.__name__} or {var} is None else {tp.__name__}({var}))'
+                return f'(None if {var} is None else {tp.__name__}({var}))'
+            origin = get_origin(tp)
+            args = get_args(tp)
+            item = f'__x{depth}'
+            if origin is list and len(args) == 1:
+                return f'[{self._expr(args[0], item, None, depth + 1)} for {item} in {var}]'
+            if origin is set and len(args) == 1:
+                return f'{{{self._expr(args[0], item, None, depth + 1)} for {item} in {var}}}'
+            if origin is tuple and len(args) == 2 and args[1] is Ellipsis:
+                return f'tuple([{self._expr(args[0], item, None, depth + 1)} for {item} in {var}])'
+            if origin is dict and len(args) == 2:
+                key = f'__k{depth}'
+                return (f'{{{self._expr(args[0], key, None, depth + 1)}: {self._expr(args[1], item, None, depth + 1)} '
+                        f'for {key}, {item} in {var}.items()}}')
+        if converter is None:
+            converter = self._converter_for(tp)
+        self._counter += 1
+        ref = f'__c{self._counter}'
+        self._namespace[ref] = converter
+        return f'{ref}({var})'
+
+
+def generate_decoder(plan, converter_for, can_inline, trusted: bool = False) -> typing.Callable[[dict], typing.Any]:
+    """
+    Generate a straight-line decoder function for the class described by `plan`
+
+    Field lookups, builtin coercions and list, set, dict and variable length tuple containers are inlined into the
+    generated source, any other type is delegated to the converter returned by `converter_for`. Whenever the input is
+    not the common case (missing or unknown fields) the generated function falls back to the generic plan so errors
+    are reported identically
+    :param plan: The class plan to generate a decoder for
+    :param converter_for: Callable returning the compiled converter for a type
+    :param can_inline: Callable returning whether a type may be inlined, i.e. it has no registered delegate
+    :param trusted: Whether primitives already of the annotated type are passed through without a constructor call
+    :return: The generated decoder
+    """
+    return _DecoderBuilder(plan, converter_for, can_inline, trusted).build()
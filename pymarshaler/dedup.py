@@ -0,0 +1,127 @@
+import dataclasses
+import datetime
+import sys
+import threading
+import typing
+
+# Marker interning the strings of a field annotated with `typing.Annotated[str, INTERN]`
+INTERN = 'pymarshaler.intern'
+
+_Annotated = getattr(typing, 'Annotated', None)
+if _Annotated is not None:
+    Interned = _Annotated[str, INTERN]
+
+
+def is_interned(cls) -> bool:
+    """
+    Returns whether `cls` is annotated with the INTERN marker
+    """
+    return INTERN in getattr(cls, '__metadata__', ())
+
+
+def compile_intern_delegate(convert):
+    """
+    Wrap a converter so the strings it returns are interned, sharing one copy of each distinct string
+    """
+    intern = sys.intern
+
+    def delegate(data):
+        value = convert(data)
+        return intern(value) if value.__class__ is str else value
+    return delegate
+
+
+class DedupTable:
+    """
+    Bounded tables of the immutable values decoded so far, so decoding a value equal to an earlier one returns the
+    earlier object rather than a new copy. Each converter gets its own table, emptied once it holds `size` values.
+    With `per_call` the tables only live for the duration of a single top level decode
+    """
+
+    def __init__(self, size: int, per_call: bool = False):
+        self.size = size
+        self.per_call = per_call
+        self._local = threading.local()
+
+    def wrap(self, convert) -> typing.Callable[[typing.Any], typing.Any]:
+        """
+        Wrap the converter of an immutable type so equal values are shared
+        """
+        size = self.size
+        if self.per_call:
+            local = self._local
+            token = object()
+
+            def dedup(data):
+                value = convert(data)
+                tables = getattr(local, 'tables', None)
+                if tables is None:
+                    return value
+                table = tables.get(token)
+                if table is None:
+                    table = tables[token] = {}
+                return _share(table, value, size)
+            return dedup
+
+        table = {}
+
+        def dedup(data):
+            return _share(table, convert(data), size)
+        return dedup
+
+    def scope(self, convert) -> typing.Callable[[typing.Any], typing.Any]:
+        """
+        Wrap a top level decoder so each call gets its own tables, when they are per call
+        """
+        if not self.per_call:
+            return convert
+        local = self._local
+
+        def scoped(data):
+            outer = getattr(local, 'tables', None)
+            local.tables = {}
+            try:
+                return convert(data)
+            finally:
+                local.tables = outer
+        return scoped
+
+
+def _share(table: dict, value, size: int):
+    try:
+        shared = table.setdefault(_typed_key(value), value)
+    except TypeError:
+        # e.g. a frozen dataclass holding a list
+        return value
+    if shared is value and len(table) > size:
+        table.clear()
+    return shared
+
+
+# Field names of the dataclasses seen by _typed_key
+_FIELDS = {}
+
+
+def _typed_key(value):
+    """
+    A key equal only for values of the same types all the way down, so equal but different values such as 1, 1.0 and
+    True, or datetimes of the same instant in different timezones, are never shared
+    """
+    cls = value.__class__
+    if cls is float:
+        # Also tells 0.0 and -0.0 apart
+        return cls, value.hex()
+    if isinstance(value, tuple):
+        return cls, tuple([_typed_key(item) for item in value])
+    if isinstance(value, frozenset):
+        return cls, frozenset([_typed_key(item) for item in value])
+    if isinstance(value, (datetime.datetime, datetime.time)):
+        return cls, value, value.tzinfo
+    if dataclasses.is_dataclass(cls):
+        if not cls.__dataclass_params__.frozen:
+            raise TypeError(f'{cls.__name__} is mutable')
+        names = _FIELDS.get(cls)
+        if names is None:
+            names = _FIELDS[cls] = tuple(f.name for f in dataclasses.fields(cls))
+        return cls, tuple([_typed_key(getattr(value, name)) for name in names])
+    return cls, value
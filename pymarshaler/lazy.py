@@ -0,0 +1,118 @@
+import dataclasses
+import typing
+
+_ORIGIN_ATTRIBUTE = '__pymarshaler_lazy_origin__'
+
+
+class Pending:
+    """
+    The raw JSON value of a field which hasn't been decoded yet, along with the converter decoding it
+    """
+
+    __slots__ = ('raw', 'convert')
+
+    def __init__(self, raw, convert):
+        self.raw = raw
+        self.convert = convert
+
+    def resolve(self):
+        return self.convert(self.raw)
+
+
+class _LazyField:
+    """
+    Data descriptor decoding the pending value of a field on first access and caching the result on the instance
+    """
+
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return getattr(origin_of(owner), self.name)
+        values = instance.__dict__
+        try:
+            value = values[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+        if value.__class__ is Pending:
+            value = values[self.name] = value.resolve()
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+    def __delete__(self, instance):
+        try:
+            del instance.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+
+def supports_lazy(cls) -> bool:
+    """
+    Returns whether instances of `cls` can be decoded lazily, i.e. it is a dataclass storing its fields in `__dict__`
+    """
+    return dataclasses.is_dataclass(cls) and '__slots__' not in cls.__dict__
+
+
+def origin_of(cls):
+    """
+    Returns the class a lazy subclass was generated for, or `cls` itself if it isn't one
+    """
+    return cls.__dict__.get(_ORIGIN_ATTRIBUTE, cls)
+
+
+def is_lazy_class(cls) -> bool:
+    return _ORIGIN_ATTRIBUTE in cls.__dict__
+
+
+def pending(convert) -> typing.Callable[[typing.Any], Pending]:
+    """
+    Build a converter deferring `convert` until the field holding its result is first read
+    """
+    def defer(raw):
+        return Pending(raw, convert)
+    return defer
+
+
+def lazy_subclass(cls, names: typing.Iterable[str]):
+    """
+    Generate a subclass of the dataclass `cls` whose `names` fields may hold pending values
+
+    The subclass shares the name, repr, equality and hash of `cls`, and pickles as a fully decoded `cls` instance
+    :param cls: The dataclass
+    :param names: The fields decoded on first access
+    :return: The generated subclass
+    """
+    compared = [f.name for f in dataclasses.fields(cls) if f.compare]
+    namespace = {name: _LazyField(name) for name in names}
+
+    def __eq__(self, other):
+        if origin_of(other.__class__) is not cls:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in compared)
+
+    def __reduce_ex__(self, protocol):
+        state = {key: value.resolve() if value.__class__ is Pending else value for key, value in self.__dict__.items()}
+        return _restore, (cls, state)
+
+    namespace.update({
+        _ORIGIN_ATTRIBUTE: cls,
+        '__module__': cls.__module__,
+        '__qualname__': cls.__qualname__,
+        '__doc__': cls.__doc__,
+        '__hash__': cls.__hash__,
+        '__reduce_ex__': __reduce_ex__
+    })
+    if cls.__dataclass_params__.eq:
+        namespace['__eq__'] = __eq__
+    return type(cls.__name__, (cls,), namespace)
+
+
+def _restore(cls, state: dict):
+    instance = cls.__new__(cls)
+    instance.__dict__.update(state)
+    return instance
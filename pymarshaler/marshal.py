@@ -1,113 +1,1176 @@
+import abc
+import array
+import asyncio
+import base64
+import collections.abc as abc_collections
+import dataclasses
 import datetime
+import functools
+import importlib.util
 import inspect
+import itertools
+import operator
+import mmap
+import os
+import threading
+import types
 import typing
+import uuid
 from enum import Enum
 
 import orjson
 
-from pymarshaler.arg_delegates import enum_delegate, \
-    user_defined_delegate, datetime_delegate, builtin_delegate, list_delegate, tuple_delegate, dict_delegate, \
-    set_delegate
-from pymarshaler.errors import MissingFieldsError, InvalidDelegateError, PymarshalError
-from pymarshaler.utils import is_builtin, is_user_defined
+from pymarshaler import lazy, parallel, streaming
+from pymarshaler.arg_delegates import DATETIME_ISO, DATETIME_EPOCH, DATETIME_EPOCH_MILLIS, DATETIME_DATEUTIL, \
+    NUMERIC_LISTS, NUMERIC_NUMPY, is_valid_datetime_format, is_numeric_list, is_primitive_container, any_delegate, \
+    compile_union_delegate, compile_literal_delegate, compile_enum_delegate, compile_datetime_delegate, \
+    compile_builtin_delegate, compile_tagged_union_delegate, compile_positional_delegate, compile_bytes_delegate, \
+    compile_numeric_array_delegate, compile_trusted_container_delegate, compile_list_delegate, compile_tuple_delegate, \
+    compile_dict_delegate, compile_set_delegate
+from pymarshaler.cache import CACHE_AUTO, CACHE_MODES, CACHE_SHARE, ResultCache
+from pymarshaler.codecs import CODEC_JSON, get_codec
+from pymarshaler.codegen import generate_decoder
+from pymarshaler.errors import MissingFieldsError, InvalidDelegateError, PymarshalError, UnknownFieldError
+from pymarshaler.dedup import INTERN, DedupTable, compile_intern_delegate, is_interned
+from pymarshaler.stats import DecodeStats
+from pymarshaler.unions import TaggedUnions, any_declared
+from pymarshaler.utils import DATETIME_TYPES, get_origin, get_args, is_builtin, is_user_defined, get_class_metadata, \
+    import_path, import_from_path, is_namedtuple
+
+
+UPDATE_REPLACE = 'replace'
+UPDATE_APPEND = 'append'
+UPDATE_MERGE = 'merge'
+
+# Payloads of at least this many bytes are decoded in an executor by the async APIs
+DEFAULT_OFFLOAD_THRESHOLD = 1 << 16
+
+_Literal = getattr(typing, 'Literal', None)
+_Annotated = getattr(typing, 'Annotated', None)
+_WRAPPERS = tuple(wrapper for wrapper in (getattr(typing, 'Final', None), typing.ClassVar) if wrapper is not None)
+
+
+def _is_deferrable(tp) -> bool:
+    """
+    Whether a field annotated with `tp` is worth decoding lazily: user defined classes and containers
+    """
+    origin = get_origin(tp)
+    if origin is typing.Union:
+        return any(_is_deferrable(arg) for arg in get_args(tp))
+    if origin is not None:
+        return inspect.isclass(origin) and issubclass(origin, abc_collections.Collection) \
+            and not issubclass(origin, (str, bytes))
+    return is_user_defined(tp) and not issubclass(tp, Enum)
+
+
+def _mapping_args(tp) -> typing.Optional[tuple]:
+    """
+    The key and value types of a field annotated with a mapping type, e.g. `Optional[Dict[str, int]]`. None when
+    `tp` isn't a mapping
+    """
+    if hasattr(tp, '__metadata__'):
+        return _mapping_args(tp.__origin__)
+    origin = get_origin(tp)
+    if origin is typing.Union:
+        args = [arg for arg in get_args(tp) if arg is not type(None)]
+        return _mapping_args(args[0]) if len(args) == 1 else None
+    if tp is dict:
+        return typing.Any, typing.Any
+    if not inspect.isclass(origin) or not issubclass(origin, abc_collections.Mapping):
+        return None
+    args = get_args(tp)
+    return args if len(args) == 2 else (typing.Any, typing.Any)
 
 
 class _RegisteredDelegates:
+    """
+    Registered delegates, safe to read from any number of threads without locking. Registration never mutates the
+    published dicts, it swaps in updated copies
+    """
 
-    def __init__(self):
-        self.registered_delegates = {}
+    def __init__(self, registered_delegates: dict = None):
+        self.registered_delegates = dict(registered_delegates or {})
+        self._lookup = {}
 
     def register(self, cls, delegate):
-        self.registered_delegates[cls] = delegate
+        registered = dict(self.registered_delegates)
+        registered[cls] = delegate
+        # Publish the delegates before the new memo, so a memo is never filled from delegates older than itself
+        self.registered_delegates = registered
+        self._lookup = {}
 
     def get_for(self, cls):
+        """
+        Find the delegate registered for `cls` or its closest registered base class. Parameterized generics such as
+        `List[Foo]` only match a delegate registered for that exact type. Results, including misses, are memoized
+        """
+        lookup = self._lookup
         try:
-            for delegate_cls, delegate in self.registered_delegates.items():
-                if cls == delegate_cls or issubclass(cls, delegate_cls):
-                    return delegate
-            return None
+            return lookup[cls]
+        except KeyError:
+            pass
         except TypeError:
             return None
+        delegate = self._find(self.registered_delegates, cls)
+        lookup[cls] = delegate
+        return delegate
+
+    @staticmethod
+    def _find(registered: dict, cls):
+        delegate = registered.get(cls)
+        if delegate is not None or not inspect.isclass(cls):
+            return delegate
+        for base in cls.__mro__[1:]:
+            delegate = registered.get(base)
+            if delegate is not None:
+                return delegate
+        # Virtual subclasses, e.g. classes registered with an ABC, aren't part of the MRO
+        for delegate_cls, delegate in registered.items():
+            if isinstance(delegate_cls, abc.ABCMeta) and issubclass(cls, delegate_cls):
+                return delegate
+        return None
+
+
+class _ClassPlan:
+    """
+    Decoding plan for a user defined class, built once per class and reused for every object decoded
+    """
+
+    __slots__ = ('cls', 'fields', 'types', 'required', '_required_set', 'extra_keys', 'ignore_unknown_fields',
+                 'walk_unknown_fields')
+
+    def __init__(self, cls, ignore_unknown_fields: bool, walk_unknown_fields: bool):
+        self.cls = cls
+        self.fields = {}
+        self.types = {}
+        # Keys which aren't fields but are expected in the data, e.g. the tag of a tagged union
+        self.extra_keys = frozenset()
+        self.required = get_class_metadata(cls).required
+        self._required_set = frozenset(self.required)
+        self.ignore_unknown_fields = ignore_unknown_fields
+        self.walk_unknown_fields = walk_unknown_fields
+
+    def build_args(self, data: dict) -> dict:
+        fields = self.fields
+        args = {}
+        for key, value in data.items():
+            convert = fields.get(key)
+            if convert is not None:
+                args[key] = convert(value)
+            elif key in self.extra_keys:
+                continue
+            elif not self.ignore_unknown_fields:
+                raise UnknownFieldError(f'Found unknown field ({key}: {value}). '
+                                        'If you would like to skip unknown fields '
+                                        'create a Marshal object who can skip ignore_unknown_fields')
+            elif self.walk_unknown_fields:
+                if isinstance(value, dict):
+                    args.update(self.build_args(value))
+                elif isinstance(value, (list, set, tuple)):
+                    for x in value:
+                        if isinstance(x, dict):
+                            args.update(self.build_args(x))
+        return args
+
+    def decode(self, data: dict):
+        args = self.build_args(data)
+        if not self._required_set <= args.keys():
+            unfilled = [k for k in self.required if k not in args]
+            raise MissingFieldsError(f'Missing required field(s): {", ".join(unfilled)}')
+        return self.cls(**args)
+
+
+_MISSING = object()
+
+
+class _UpdateLog:
+    """
+    The in place changes of an update, applied together once every value has been decoded and undone if applying them
+    or a `validate` hook fails
+    """
+
+    def __init__(self):
+        self.changes = []
+        self.validated = []
+
+    def setattr(self, obj, name: str, value):
+        self.changes.append((obj, name, value, _set_attribute))
+
+    def setitem(self, mapping: dict, key, value):
+        # _MISSING removes the key
+        self.changes.append((mapping, key, value, _set_item))
+
+    def extend(self, sequence, values):
+        self.changes.append((sequence, None, values, _extend))
+
+    def commit(self):
+        undo = []
+        try:
+            for target, key, value, apply in self.changes:
+                undo.append(apply(target, key, value))
+            for obj in self.validated:
+                obj.validate()
+        except BaseException:
+            for revert in reversed(undo):
+                revert()
+            raise
+
+
+def _set_attribute(obj, name: str, value):
+    previous = getattr(obj, name, _MISSING)
+    setattr(obj, name, value)
+
+    def revert():
+        if previous is _MISSING:
+            delattr(obj, name)
+        else:
+            setattr(obj, name, previous)
+    return revert
+
+
+def _set_item(mapping: dict, key, value):
+    previous = mapping.get(key, _MISSING)
+    if value is _MISSING:
+        mapping.pop(key, None)
+    else:
+        mapping[key] = value
+
+    def revert():
+        if previous is _MISSING:
+            mapping.pop(key, None)
+        else:
+            mapping[key] = previous
+    return revert
+
+
+def _extend(sequence, key, values):
+    length = len(sequence)
+    sequence.extend(values)
+
+    def revert():
+        del sequence[length:]
+    return revert
 
 
 class _Resolver:
 
-    def __init__(self, func, ignore_unknown_fields: bool, walk_unknown_fields: bool):
-        self._func = func
+    def __init__(self, ignore_unknown_fields: bool, walk_unknown_fields: bool, codegen: bool = False,
+                 datetime_format: str = DATETIME_ISO, enum_by_name: bool = False, enum_case_insensitive: bool = False,
+                 unions: TaggedUnions = None, lazy: bool = False, numeric_lists: str = None, trusted: bool = False,
+                 intern_strings: typing.Union[bool, typing.Iterable[str]] = False, dedup: int = 0,
+                 dedup_per_call: bool = False, positional: bool = False):
         self.ignore_unknown_fields = ignore_unknown_fields
         self.walk_unknown_fields = walk_unknown_fields
+        self.codegen = codegen
+        self.lazy = lazy
+        self.numeric_lists = numeric_lists
+        self.trusted = trusted
+        self.positional = positional
+        self.intern_all = intern_strings is True
+        self.intern_fields = frozenset() if isinstance(intern_strings, bool) else frozenset(intern_strings)
+        self._dedup = DedupTable(dedup, dedup_per_call) if dedup else None
+        self.stats = None
+        self.datetime_format = datetime_format
+        self.enum_by_name = enum_by_name
+        self.enum_case_insensitive = enum_case_insensitive
         self._registered_delegates = _RegisteredDelegates()
-        self._default_arg_builder_delegates = {
-            typing.List._name: list_delegate,
-            typing.Set._name: set_delegate,
-            typing.Tuple._name: tuple_delegate,
-            typing.Dict._name: dict_delegate,
-            "PythonBuiltin": builtin_delegate,
-            "UserDefined": user_defined_delegate,
-            "DateTime": datetime_delegate
-        }
+        self._unions = unions if unions is not None else TaggedUnions()
+        self._lock = threading.RLock()
+        self._compiling = set()
+        self._converters = {}
+        self._entries = {}
+        self._plans = {}
+        self._class_decoders = {}
+
+    def registered_delegates(self) -> dict:
+        return dict(self._registered_delegates.registered_delegates)
 
     def register(self, cls, func):
-        self._registered_delegates.register(cls, func)
+        with self._lock:
+            self._registered_delegates.register(cls, func)
+            self._invalidate()
+
+    def register_union(self, base, field: str, tags: typing.Optional[dict]):
+        with self._lock:
+            self._unions.register(base, field, tags)
+            self._invalidate()
+
+    def set_stats(self, stats: typing.Optional[DecodeStats]):
+        """
+        Start recording into `stats`, or stop recording if None. Converters are only wrapped while recording
+        """
+        with self._lock:
+            self.stats = stats
+            self._invalidate()
 
     def resolve(self, cls, data) -> typing.Any:
-        is_class = inspect.isclass(cls)
+        return self.converter_for(cls)(data)
 
-        if not is_class:
-            if '_name' in cls.__dict__:
-                return self._safe_get(cls._name)(cls, data, self._func)
-        else:
-            delegate_maybe = self._registered_delegates.get_for(cls)
-            if delegate_maybe:
-                return delegate_maybe(data)
-            elif issubclass(cls, Enum):
-                return enum_delegate(cls, data, None)
-            elif is_user_defined(cls):
-                return user_defined_delegate(cls,
-                                             data,
-                                             self._func,
-                                             self.ignore_unknown_fields,
-                                             self.walk_unknown_fields)
-            elif issubclass(cls, datetime.datetime):
-                return datetime_delegate(cls, data, None)
-            elif is_builtin(cls):
-                return builtin_delegate(cls, data, None)
+    def entry_for(self, cls) -> typing.Callable[[typing.Any], typing.Any]:
+        """
+        Get the top level decoder for `cls`, which also runs the class' validate hook if it defines one
+        """
+        try:
+            return self._entries[cls]
+        except KeyError:
+            pass
+        with self._lock:
+            convert = self.converter_for(cls)
+            if self._dedup is not None:
+                convert = self._dedup.scope(convert)
+            if is_user_defined(cls) and get_class_metadata(cls).has_validate:
+                def entry(data):
+                    result = convert(data)
+                    result.validate()
+                    return result
+            else:
+                entry = convert
+            self._entries[cls] = entry
+            return entry
+
+    def converter_for(self, cls) -> typing.Callable[[typing.Any], typing.Any]:
+        """
+        Get the compiled converter turning raw JSON data into an instance of `cls`
+        """
+        try:
+            return self._converters[cls]
+        except KeyError:
+            pass
+        with self._lock:
+            if cls in self._converters:
+                return self._converters[cls]
+            if cls in self._compiling:
+                # Recursive type, defer the lookup until the outer compilation has finished
+                converters = self._converters
+                return lambda data: converters[cls](data)
+            self._compiling.add(cls)
+            try:
+                convert = self._compile(cls)
+            finally:
+                self._compiling.discard(cls)
+            if self._dedup is not None and _is_immutable(cls):
+                convert = self._dedup.wrap(convert)
+            if self.stats is not None:
+                convert = self.stats.wrap(_type_name(cls), self._kind(cls), convert)
+            self._converters[cls] = convert
+            return convert
+
+    def plan_for(self, cls) -> _ClassPlan:
+        try:
+            return self._plans[cls]
+        except KeyError:
+            pass
+        with self._lock:
+            if cls in self._plans:
+                return self._plans[cls]
+            plan = _ClassPlan(cls, self.ignore_unknown_fields, self.walk_unknown_fields)
+            self._plans[cls] = plan
+            metadata = get_class_metadata(cls)
+            for name in metadata.fields:
+                param_type = metadata.params[name]
+                if name in self.intern_fields:
+                    param_type = _Annotated[param_type, INTERN]
+                plan.types[name] = param_type
+                plan.fields[name] = self._field_converter(param_type)
+                if self.stats is not None:
+                    plan.fields[name] = self.stats.wrap(f'{cls.__qualname__}.{name}', self._kind(param_type),
+                                                        plan.fields[name], fields=True)
+            tag_field = self._unions.field_for(cls)
+            if tag_field is not None and tag_field not in plan.fields:
+                plan.extra_keys = frozenset((tag_field,))
+            return plan
+
+    def class_decoder_for(self, cls) -> typing.Callable[[dict], typing.Any]:
+        """
+        Get the decoder building exactly `cls` from its fields, ignoring any tagged union it belongs to
+        """
+        try:
+            return self._class_decoders[cls]
+        except KeyError:
+            pass
+        with self._lock:
+            if cls in self._class_decoders:
+                return self._class_decoders[cls]
+            plan = self.plan_for(cls)
+            if self.lazy:
+                plan = self._lazy_plan(plan)
+            if self.codegen:
+                decode = generate_decoder(plan, self._field_converter, self._can_inline, self.trusted)
+            else:
+                decode = plan.decode
+            if is_namedtuple(cls) or self.positional:
+                decode = compile_positional_delegate(cls, plan.fields, decode)
+            self._class_decoders[cls] = decode
+            return decode
+
+    def _compile(self, cls):
+        delegate_maybe = self._registered_delegates.get_for(cls)
+        if delegate_maybe:
+            return delegate_maybe
+        if cls is typing.Any or cls is object:
+            return any_delegate
+        if isinstance(cls, typing.TypeVar):
+            return self.converter_for(cls.__bound__) if cls.__bound__ is not None else any_delegate
+        supertype = getattr(cls, '__supertype__', None)
+        if supertype is not None:
+            # typing.NewType
+            return self.converter_for(supertype)
+        origin = get_origin(cls)
+        if origin is not None:
+            return self._compile_generic(cls, origin)
+        if not inspect.isclass(cls):
+            raise InvalidDelegateError(f'No delegate for class {cls}')
+        if issubclass(cls, Enum):
+            return compile_enum_delegate(cls, self.enum_by_name, self.enum_case_insensitive)
+        elif issubclass(cls, DATETIME_TYPES):
+            return compile_datetime_delegate(cls, self.datetime_format)
+        elif is_user_defined(cls):
+            union = self._unions.index_for(cls)
+            if union is not None:
+                field, index = union
+                # Without explicit tags, subclasses defined later join the union
+                reindex = (lambda: self._unions.index_for(cls)[1]) if self._unions.union_for(cls)[2] is None else None
+                return compile_tagged_union_delegate(cls, field, index, self.class_decoder_for, reindex)
+            return self.class_decoder_for(cls)
+        elif issubclass(cls, (bytes, bytearray)):
+            return compile_bytes_delegate(cls)
+        elif is_builtin(cls):
+            if cls is str and self.intern_all:
+                return compile_intern_delegate(compile_builtin_delegate(cls, self.trusted))
+            return compile_builtin_delegate(cls, self.trusted)
 
         raise InvalidDelegateError(f'No delegate for class {cls}')
 
-    def _safe_get(self, name):
-        if name not in self._default_arg_builder_delegates:
-            raise InvalidDelegateError(f'Unsupported class type {name}')
-        return self._default_arg_builder_delegates[name]
+    def _compile_generic(self, cls, origin):
+        if origin is typing.Union:
+            return compile_union_delegate(cls, self.converter_for, self._json_types)
+        if origin is _Literal:
+            return compile_literal_delegate(cls)
+        if origin is _Annotated:
+            if is_interned(cls):
+                return compile_intern_delegate(self.converter_for(cls.__origin__))
+            return self.converter_for(cls.__origin__)
+        if origin in _WRAPPERS:
+            return self.converter_for(get_args(cls)[0])
+        if self.numeric_lists and is_numeric_list(cls):
+            return compile_numeric_array_delegate(cls, self.numeric_lists)
+        if self.trusted and is_primitive_container(cls):
+            return compile_trusted_container_delegate(cls, self._compile_container(cls, origin))
+        return self._compile_container(cls, origin)
 
+    def _compile_container(self, cls, origin):
+        if inspect.isclass(origin):
+            if issubclass(origin, tuple):
+                return compile_tuple_delegate(cls, self.converter_for)
+            if issubclass(origin, abc_collections.Mapping):
+                return compile_dict_delegate(cls, self.converter_for)
+            if issubclass(origin, abc_collections.Set):
+                return compile_set_delegate(cls, self.converter_for)
+            if issubclass(origin, abc_collections.Iterable) and not issubclass(origin, (str, bytes)):
+                return compile_list_delegate(cls, self.converter_for)
+        raise InvalidDelegateError(f'Unsupported class type {cls}')
 
-def _default(o):
-    if isinstance(o, set):
-        return list(o)
+    def _json_types(self, cls) -> typing.Optional[tuple]:
+        """
+        The JSON types, as the python types orjson decodes them to, that `cls` can be decoded from.
+        None if that can't be known up front
+        """
+        if cls is type(None):
+            return type(None),
+        if self._registered_delegates.get_for(cls) is not None:
+            return None
+        supertype = getattr(cls, '__supertype__', None)
+        if supertype is not None:
+            return self._json_types(supertype)
+        origin = get_origin(cls)
+        if origin is typing.Union:
+            accepted = [self._json_types(member) for member in get_args(cls)]
+            return None if None in accepted else tuple(set(itertools.chain.from_iterable(accepted)))
+        if origin is _Literal:
+            return tuple({value.value.__class__ if isinstance(value, Enum) else value.__class__
+                          for value in get_args(cls)})
+        if origin is _Annotated:
+            return self._json_types(cls.__origin__)
+        if origin in _WRAPPERS:
+            return self._json_types(get_args(cls)[0])
+        if origin is not None:
+            cls = origin
+        if not inspect.isclass(cls) or cls is object:
+            return None
+        if issubclass(cls, Enum):
+            if self.enum_by_name:
+                return str,
+            return tuple({member.value.__class__ for member in cls})
+        if issubclass(cls, datetime.datetime):
+            return (int, float) if self.datetime_format in (DATETIME_EPOCH, DATETIME_EPOCH_MILLIS) else (str,)
+        if issubclass(cls, datetime.timedelta):
+            return int, float
+        if issubclass(cls, (datetime.date, datetime.time)):
+            return str,
+        if cls is bool:
+            return bool,
+        if cls is float:
+            return float, int
+        for json_type in (int, str):
+            if issubclass(cls, json_type):
+                return json_type,
+        if issubclass(cls, abc_collections.Mapping):
+            return dict,
+        if is_namedtuple(cls):
+            return dict, list
+        if issubclass(cls, abc_collections.Iterable) and not issubclass(cls, (str, bytes)):
+            return list,
+        if issubclass(cls, (bytes, bytearray)):
+            return str,
+        if is_user_defined(cls):
+            return (dict, list) if self.positional else (dict,)
+        return None
+
+    def _field_converter(self, param_type):
+        try:
+            return self.converter_for(param_type)
+        except InvalidDelegateError as e:
+            error = e
+
+            # Only fail if the field is actually present in the data
+            def unsupported(data):
+                raise error
+            return unsupported
+
+    def update(self, obj, data: dict, list_mode: str, dict_mode: str):
+        """
+        Apply the fields present in `data` to `obj`, see `Marshal.update`. Every value is decoded before anything is
+        changed, so a failure leaves `obj` untouched
+        """
+        log = _UpdateLog()
+        obj = self._update(obj, data, list_mode, dict_mode, log)
+        log.commit()
+        return obj
 
+    def _update(self, obj, data: dict, list_mode: str, dict_mode: str, log: '_UpdateLog'):
+        cls = lazy.origin_of(obj.__class__)
+        if not is_user_defined(cls) or not isinstance(data, dict):
+            raise PymarshalError(f'Can not update {cls.__name__} with {data}')
+        plan = self.plan_for(cls)
+        metadata = get_class_metadata(cls)
+        changes = {}
+        for key, value in data.items():
+            tp = plan.types.get(key)
+            if tp is None:
+                if key in plan.extra_keys or self.ignore_unknown_fields:
+                    continue
+                raise UnknownFieldError(f'Found unknown field ({key}: {value}) updating {cls.__name__}')
+            current = getattr(obj, metadata.attributes[key], None)
+            changes[key] = self._updated_value(current, value, tp, plan.fields[key], list_mode, dict_mode, log)
+
+        if is_namedtuple(cls):
+            obj = obj._replace(**changes)
+        elif dataclasses.is_dataclass(cls) and cls.__dataclass_params__.frozen:
+            obj = dataclasses.replace(obj, **changes)
+        else:
+            for key, value in changes.items():
+                log.setattr(obj, metadata.attributes[key], value)
+        if metadata.has_validate:
+            log.validated.append(obj)
+        return obj
+
+    def _updated_value(self, current, value, tp, convert, list_mode: str, dict_mode: str, log: '_UpdateLog'):
+        if current is None or value is None:
+            return convert(value)
+        if value.__class__ is dict:
+            if self._updatable(current, value, tp):
+                return self._update(current, value, list_mode, dict_mode, log)
+            if dict_mode == UPDATE_MERGE and current.__class__ is dict:
+                args = _mapping_args(tp)
+                if args is not None:
+                    return self._merge_dict(current, value, args, list_mode, dict_mode, log)
+        elif value.__class__ is list and list_mode == UPDATE_APPEND and isinstance(current, (list, array.array)):
+            log.extend(current, convert(value))
+            return current
+        return convert(value)
+
+    def _updatable(self, current, value: dict, tp) -> bool:
+        """
+        Whether the nested object `current` can be updated with `value` rather than being replaced by a decoded one
+        """
+        cls = lazy.origin_of(current.__class__)
+        if tp is typing.Any or get_origin(tp) not in (None, typing.Union, _Annotated):
+            return False
+        if not is_user_defined(cls) or issubclass(cls, Enum) or issubclass(cls, (list, dict, set)):
+            return False
+        if self._registered_delegates.get_for(cls) is not None or self._registered_delegates.get_for(tp) is not None:
+            return False
+        # A different tag means a different class in the tagged union, which has to be decoded from scratch
+        field = self._unions.field_for(cls)
+        return field is None or field not in value or value[field] == self._unions.tag_for(cls)[1]
+
+    def _merge_dict(self, current: dict, value: dict, args: tuple, list_mode: str, dict_mode: str,
+                    log: '_UpdateLog') -> dict:
+        convert_key = self.converter_for(args[0])
+        convert_item = self._field_converter(args[1])
+        for key, item in value.items():
+            key = convert_key(key)
+            if item is None:
+                log.setitem(current, key, _MISSING)
+            else:
+                updated = self._updated_value(current.get(key), item, args[1], convert_item, list_mode, dict_mode, log)
+                log.setitem(current, key, updated)
+        return current
+
+    def _lazy_plan(self, plan: _ClassPlan) -> _ClassPlan:
+        """
+        Derive a plan building a lazy subclass of the plan's class, whose nested objects and containers are only
+        decoded when first read. Returns `plan` itself when the class can't be decoded lazily
+        """
+        names = [name for name, tp in plan.types.items() if _is_deferrable(tp)]
+        if not names or not lazy.supports_lazy(plan.cls):
+            return plan
+        lazy_plan = _ClassPlan(plan.cls, self.ignore_unknown_fields, self.walk_unknown_fields)
+        lazy_plan.cls = lazy.lazy_subclass(plan.cls, names)
+        lazy_plan.extra_keys = plan.extra_keys
+        for name, convert in plan.fields.items():
+            if name in names:
+                lazy_plan.types[name] = lazy.Pending
+                lazy_plan.fields[name] = lazy.pending(convert)
+            else:
+                lazy_plan.types[name] = plan.types[name]
+                lazy_plan.fields[name] = convert
+        return lazy_plan
+
+    def _kind(self, cls) -> str:
+        """
+        The kind of decoder `cls` is compiled to, as reported in decode statistics
+        """
+        if self._registered_delegates.get_for(cls) is not None:
+            return 'registered'
+        supertype = getattr(cls, '__supertype__', None)
+        if supertype is not None:
+            return self._kind(supertype)
+        origin = get_origin(cls)
+        if origin is typing.Union:
+            return 'union'
+        if origin is _Literal:
+            return 'literal'
+        if origin is _Annotated:
+            return self._kind(cls.__origin__)
+        if origin in _WRAPPERS:
+            return self._kind(get_args(cls)[0])
+        if origin is not None:
+            if self.numeric_lists and is_numeric_list(cls):
+                return 'array'
+            if inspect.isclass(origin):
+                for kind, base in (('tuple', tuple), ('dict', abc_collections.Mapping), ('set', abc_collections.Set),
+                                   ('list', abc_collections.Iterable)):
+                    if issubclass(origin, base):
+                        return kind
+            return 'any'
+        if not inspect.isclass(cls) or cls is object:
+            return 'any'
+        if issubclass(cls, Enum):
+            return 'enum'
+        if issubclass(cls, DATETIME_TYPES):
+            return 'datetime'
+        if is_user_defined(cls):
+            return 'tagged_union' if self._unions.index_for(cls) is not None else 'user_defined'
+        return 'builtin'
+
+    def _can_inline(self, cls) -> bool:
+        if self.stats is not None:
+            # Inlined fields would bypass the timed converters
+            return False
+        if self.numeric_lists and is_numeric_list(cls):
+            return False
+        if self.trusted and is_primitive_container(cls):
+            # The trusted delegate's type check is cheaper than an inlined comprehension
+            return False
+        if cls is str and self.intern_all:
+            return False
+        if self._dedup is not None and _is_immutable(cls):
+            # Inlined values would bypass the dedup tables
+            return False
+        return self._registered_delegates.get_for(cls) is None
+
+    def _invalidate(self):
+        self._converters = {}
+        self._entries = {}
+        self._plans = {}
+        self._class_decoders = {}
+
+
+_UNKNOWN = object()
+_CONTAINERS = (list, tuple, set, frozenset, dict)
+
+
+class _Encoder:
+    """
+    Builds and caches a serializer per class, used as the codec's `default` hook for anything it can't handle natively
+    """
+
+    def __init__(self, datetime_format: str = DATETIME_ISO, enum_by_name: bool = False, unions: TaggedUnions = None,
+                 positional: bool = False):
+        self._encoders = {}
+        self._union_reach = {}
+        self.datetime_format = datetime_format
+        self.enum_by_name = enum_by_name
+        self.unions = unions if unions is not None else TaggedUnions()
+        self.positional = positional
+        # orjson writes ISO 8601 datetimes natively, any other format has to go through `default`
+        self.option = 0 if datetime_format in (DATETIME_ISO, DATETIME_DATEUTIL) else orjson.OPT_PASSTHROUGH_DATETIME
+        # numpy arrays, e.g. decoded with numeric_lists='numpy', are written natively without being converted to lists
+        self.option |= orjson.OPT_SERIALIZE_NUMPY
+        # Dicts keyed by enums, ints, dates, ... round trip, as decoding converts their keys back
+        self.option |= orjson.OPT_NON_STR_KEYS
+        if enum_by_name:
+            # orjson always writes enums by value, so their names are written by the class encoders using type hints
+            self.option |= orjson.OPT_PASSTHROUGH_DATACLASS
+        if positional:
+            self.option |= orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def options(self, option: int, obj=_UNKNOWN) -> int:
+        """
+        The orjson option flags to write `obj` with, given the caller's `option`
+        """
+        option |= self.option
+        if not option & orjson.OPT_PASSTHROUGH_DATACLASS and (self.unions.registered or any_declared()) \
+                and (obj is _UNKNOWN or self._may_hold_union(obj)):
+            # Tags are written by the class encoders, so dataclasses which may be union members can't be left to orjson
+            option |= orjson.OPT_PASSTHROUGH_DATACLASS
+        return option
+
+    def invalidate(self):
+        self._encoders = {}
+        self._union_reach = {}
+
+    def _may_hold_union(self, obj) -> bool:
+        cls = obj.__class__
+        if cls in (list, tuple, set, frozenset):
+            for klass in set(map(type, obj)):
+                if klass in _CONTAINERS:
+                    if any(self._may_hold_union(item) for item in obj if item.__class__ is klass):
+                        return True
+                elif self._reaches_union(klass):
+                    return True
+            return False
+        if cls is dict:
+            return self._may_hold_union(list(obj.values()))
+        return self._reaches_union(cls)
+
+    def _reaches_union(self, cls) -> bool:
+        """
+        Whether an instance of `cls` may hold a tagged union member, so its tags have to be written
+        """
+        try:
+            return self._union_reach[cls]
+        except KeyError:
+            pass
+        result = self._type_reaches_union(cls, set())
+        self._union_reach[cls] = result
+        return result
+
+    def _type_reaches_union(self, tp, seen: set) -> bool:
+        if tp in seen:
+            return False
+        seen.add(tp)
+        if tp is typing.Any or tp is object or isinstance(tp, (str, typing.TypeVar, typing.ForwardRef)):
+            return True
+        if hasattr(tp, '__metadata__'):
+            return self._type_reaches_union(tp.__origin__, seen)
+        origin = get_origin(tp)
+        if origin is not None and origin is _Literal:
+            return False
+        if origin is not None:
+            return any(self._type_reaches_union(arg, seen) for arg in get_args(tp) if arg is not Ellipsis)
+        if not inspect.isclass(tp) or issubclass(tp, Enum):
+            return False
+        if self.unions.union_for(tp) is not None:
+            return True
+        if not is_user_defined(tp) or issubclass(tp, (bytes, bytearray, uuid.UUID)):
+            return False
+        try:
+            params = get_class_metadata(lazy.origin_of(tp)).params
+        except Exception:
+            return True
+        return any(self._type_reaches_union(param, seen) for param in params.values())
+
+    def default(self, o):
+        try:
+            encode = self._encoders[o.__class__]
+        except KeyError:
+            encode = self._compile(o.__class__)
+            self._encoders[o.__class__] = encode
+        return encode(o)
+
+    def _compile(self, cls):
+        if issubclass(cls, (set, frozenset)):
+            return _encode_set
+        if issubclass(cls, datetime.datetime):
+            return _datetime_encoder(self.datetime_format)
+        if issubclass(cls, (datetime.date, datetime.time)):
+            return cls.isoformat
+        if issubclass(cls, datetime.timedelta):
+            return cls.total_seconds
+        if cls is lazy.Pending:
+            return lazy.Pending.resolve
+        if issubclass(cls, array.array) or _is_numpy_array(cls):
+            return cls.tolist
+        # Only reached by codecs without native support for them, orjson handles enums and UUIDs itself
+        if issubclass(cls, (bytes, bytearray, memoryview)):
+            return _encode_bytes
+        if issubclass(cls, Enum):
+            return _enum_name if self.enum_by_name else _enum_value
+        if issubclass(cls, uuid.UUID):
+            return str
+        cls = lazy.origin_of(cls)
+        if is_user_defined(cls) and (dataclasses.is_dataclass(cls) or inspect.isfunction(cls.__init__)
+                                     or is_namedtuple(cls)):
+            metadata = get_class_metadata(cls)
+            names = metadata.fields
+            attributes = metadata.attributes
+            transforms = {}
+            if self.enum_by_name:
+                transforms = {name: _enum_name_transform(metadata.params[name]) for name in names}
+                transforms = {name: transform for name, transform in transforms.items() if transform is not None}
+            tag = self.unions.tag_for(cls)
+            if self.positional:
+                return _positional_encoder(names, attributes, transforms, tag)
+            if tag is not None and tag[0] in names:
+                tag = None
+            if not transforms and tag is None:
+                if is_namedtuple(cls) and names == cls._fields:
+                    def encode(o):
+                        return dict(zip(names, o))
+                    return encode
+                if all(name == attributes[name] for name in names):
+                    def encode(o):
+                        return {name: getattr(o, name) for name in names}
+                    return encode
+
+            def encode(o):
+                result = {tag[0]: tag[1]} if tag is not None else {}
+                for name in names:
+                    result[name] = getattr(o, attributes[name])
+                for name, transform in transforms.items():
+                    result[name] = transform(result[name])
+                return result
+            return encode
+        raise TypeError(f'Type is not JSON serializable: {cls.__name__}')
+
+
+def _is_immutable(cls) -> bool:
+    """
+    Whether values of `cls` are deeply immutable, so equal values may be shared: the type itself is immutable and so is
+    everything it may hold, e.g. `Tuple[int, ...]` or a frozen dataclass whose fields are all deeply immutable
+    """
     try:
-        return o.__dict__
-    except AttributeError:
-        return repr(o)
+        return _immutable_cache[cls]
+    except KeyError:
+        pass
+    except TypeError:
+        return _is_deeply_immutable(cls, set())
+    result = _immutable_cache[cls] = _is_deeply_immutable(cls, set())
+    return result
+
+
+_immutable_cache = {}
+_SCALAR_TYPES = (str, int, float, bool, bytes, type(None), uuid.UUID, Enum) + DATETIME_TYPES
+
+
+def _is_deeply_immutable(tp, seen: set) -> bool:
+    if tp in seen:
+        # A recursive type, e.g. a frozen node holding Optional[node], is immutable if the rest of it is
+        return True
+    seen.add(tp)
+    if hasattr(tp, '__metadata__'):
+        return _is_deeply_immutable(tp.__origin__, seen)
+    origin = get_origin(tp)
+    if origin is _Literal:
+        return True
+    if origin is typing.Union:
+        return all(_is_deeply_immutable(arg, seen) for arg in get_args(tp))
+    if origin is not None:
+        args = [arg for arg in get_args(tp) if arg is not Ellipsis]
+        return inspect.isclass(origin) and issubclass(origin, (tuple, frozenset)) and bool(args) \
+            and all(_is_deeply_immutable(arg, seen) for arg in args)
+    if not inspect.isclass(tp):
+        return False
+    if issubclass(tp, _SCALAR_TYPES):
+        return True
+    if is_namedtuple(tp) or (dataclasses.is_dataclass(tp) and tp.__dataclass_params__.frozen):
+        try:
+            params = get_class_metadata(tp).params
+        except Exception:
+            return False
+        return all(_is_deeply_immutable(param, seen) for param in params.values())
+    return False
+
+
+def _type_name(cls) -> str:
+    if inspect.isclass(cls):
+        return cls.__qualname__
+    return repr(cls).replace('typing.', '')
+
+
+def _positional_encoder(names: tuple, attributes: dict, transforms: dict, tag: typing.Optional[tuple] = None):
+    """
+    Build an encoder writing the fields of an object as an array, in field order, preceded by its tagged union tag
+    """
+    getters = [operator.attrgetter(attributes[name]) for name in names]
+    offset = 0 if tag is None else 1
+    indexed = [(names.index(name) + offset, transform) for name, transform in transforms.items()]
+    if tag is not None:
+        tag_value = tag[1]
+        getters.insert(0, lambda o: tag_value)
+
+    def encode(o):
+        result = [get(o) for get in getters]
+        for index, transform in indexed:
+            result[index] = transform(result[index])
+        return result
+    return encode
+
+
+def _encode_bytes(o) -> str:
+    return base64.b64encode(o).decode('ascii')
+
+
+def _enum_value(o):
+    return o.value
+
+
+def _is_numpy_array(cls) -> bool:
+    return cls.__module__ == 'numpy' and cls.__name__ == 'ndarray'
+
+
+def _datetime_encoder(datetime_format: str):
+    if datetime_format in (DATETIME_EPOCH, DATETIME_EPOCH_MILLIS):
+        scale = 1000 if datetime_format == DATETIME_EPOCH_MILLIS else 1
+
+        def encode(o):
+            if o.tzinfo is None:
+                # Naive datetimes are taken to be UTC, matching how epochs are decoded
+                o = o.replace(tzinfo=datetime.timezone.utc)
+            timestamp = o.timestamp() * scale
+            return round(timestamp) if scale != 1 else timestamp
+        return encode
+    if datetime_format in (DATETIME_ISO, DATETIME_DATEUTIL):
+        return datetime.datetime.isoformat
+
+    def encode(o):
+        return o.strftime(datetime_format)
+    return encode
+
+
+def _enum_name_transform(tp):
+    """
+    Build a function replacing the enum members held in a value annotated with `tp` by their names, or None if `tp`
+    can't hold enum members
+    """
+    if tp is typing.Any or tp is object:
+        return _nested_enum_names
+    origin = get_origin(tp)
+    args = get_args(tp)
+    if inspect.isclass(tp) and origin is None:
+        if issubclass(tp, Enum):
+            return _enum_name
+        # Unparameterized containers may hold anything
+        return _nested_enum_names if issubclass(tp, (list, tuple, set, frozenset, dict)) else None
+    transforms = [_enum_name_transform(arg) for arg in args]
+    if not any(transforms):
+        return None
+    if origin is typing.Union:
+        return _nested_enum_names
+    if inspect.isclass(origin) and issubclass(origin, abc_collections.Mapping) and len(args) == 2:
+        key = transforms[0] or _identity
+        item = transforms[1] or _identity
+        return lambda value: value if value is None else {key(k): item(v) for k, v in value.items()}
+    if inspect.isclass(origin) and issubclass(origin, abc_collections.Iterable):
+        item = next(transform for transform in transforms if transform is not None)
+        return lambda value: value if value is None else [item(x) for x in value]
+    return _nested_enum_names
+
+
+def _enum_name(value):
+    return value.name if isinstance(value, Enum) else value
+
+
+def _nested_enum_names(value):
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, (list, tuple)) and not is_namedtuple(value.__class__):
+        return [_nested_enum_names(x) for x in value]
+    if isinstance(value, (set, frozenset)):
+        return _encode_set([_nested_enum_names(x) for x in value])
+    if isinstance(value, dict):
+        return {_nested_enum_names(k): _nested_enum_names(v) for k, v in value.items()}
+    return value
+
+
+def _identity(value):
+    return value
+
+
+def _payload_size(data) -> typing.Optional[int]:
+    """
+    Size in bytes (or characters) of a raw JSON payload, or None if it is read from a file
+    """
+    if isinstance(data, memoryview):
+        return data.nbytes
+    if isinstance(data, os.PathLike):
+        return None
+    return len(data)
+
+
+async def _offload(executor, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+
+
+def _encode_set(o):
+    try:
+        return sorted(o)
+    except TypeError:
+        return list(o)
+
+
+class _SharedInstanceMethod:
+    """
+    Method which may also be called on the class itself, in which case it runs against a shared default instance
+    """
+
+    def __init__(self, func):
+        self._func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            instance = owner._shared_instance()
+        return types.MethodType(self._func, instance)
 
 
 class Marshal:
 
-    def __init__(self, ignore_unknown_fields: bool = False, walk_unknown_fields: bool = False):
+    def __init__(self, ignore_unknown_fields: bool = False, walk_unknown_fields: bool = False, codegen: bool = False,
+                 datetime_format: str = DATETIME_ISO, enum_by_name: bool = False, enum_case_insensitive: bool = False,
+                 lazy: bool = False, numeric_lists: str = None, trusted: bool = False,
+                 intern_strings: typing.Union[bool, typing.Iterable[str]] = False, dedup: int = 0,
+                 dedup_per_call: bool = False, codec: str = CODEC_JSON, positional: bool = False):
         if walk_unknown_fields and ignore_unknown_fields is False:
             raise PymarshalError('If walk_unknown_fields is True, ignore_unknown_fields must also be True')
+        if not is_valid_datetime_format(datetime_format):
+            raise PymarshalError(f'Unknown datetime_format {datetime_format}')
+        if isinstance(intern_strings, str):
+            raise PymarshalError(
+                f'intern_strings must be a bool or a collection of field names, got {intern_strings!r}')
+        if not isinstance(intern_strings, bool):
+            if _Annotated is None:
+                raise PymarshalError('Interning the strings of chosen fields requires typing.Annotated, Python 3.9+')
+            intern_strings = sorted(intern_strings)
+        if dedup < 0:
+            raise PymarshalError(f'dedup must be a positive number of values, got {dedup}')
+        if numeric_lists not in NUMERIC_LISTS:
+            raise PymarshalError(f'Unknown numeric_lists {numeric_lists}, expected one of {NUMERIC_LISTS}')
+        if numeric_lists == NUMERIC_NUMPY and importlib.util.find_spec('numpy') is None:
+            raise PymarshalError('numeric_lists=\'numpy\' requires numpy to be installed')
 
+        self._options = {
+            'ignore_unknown_fields': ignore_unknown_fields,
+            'walk_unknown_fields': walk_unknown_fields,
+            'codegen': codegen,
+            'datetime_format': datetime_format,
+            'enum_by_name': enum_by_name,
+            'enum_case_insensitive': enum_case_insensitive,
+            'lazy': lazy,
+            'numeric_lists': numeric_lists,
+            'trusted': trusted,
+            'intern_strings': intern_strings,
+            'dedup': dedup,
+            'dedup_per_call': dedup_per_call,
+            'codec': codec,
+            'positional': positional
+        }
+        self._codec = get_codec(codec)
+        self._unions = TaggedUnions()
         self._arg_builder_factory = _Resolver(
-            self._apply_typing,
             ignore_unknown_fields,
-            walk_unknown_fields
+            walk_unknown_fields,
+            codegen,
+            datetime_format,
+            enum_by_name,
+            enum_case_insensitive,
+            self._unions,
+            lazy,
+            numeric_lists,
+            trusted,
+            intern_strings,
+            dedup,
+            dedup_per_call,
+            positional
         )
+        self._encoder = _Encoder(datetime_format, enum_by_name, self._unions, positional)
+        self._frozen = False
+        self._cache = None
+        self._cache_mode = CACHE_AUTO
 
-    @staticmethod
-    def marshal(obj) -> bytes:
+    @classmethod
+    def _shared_instance(cls):
+        shared = cls.__dict__.get('_shared')
+        if shared is None:
+            shared = cls()
+            cls._shared = shared
+        return shared
+
+    def config(self) -> dict:
+        """
+        Describe this Marshal's options and registered delegates with plain data, so an equivalent Marshal can be
+        rebuilt in another process with `Marshal.from_config`. Registered classes and delegates are referenced by
+        import path, so they must be defined at module level
+        :return: A JSON serializable dict
+        """
+        delegates = self._arg_builder_factory.registered_delegates()
+        try:
+            paths = [[import_path(cls), import_path(delegate)] for cls, delegate in delegates.items()]
+            unions = [
+                [import_path(base), field,
+                 None if tags is None else {tag: import_path(klass) for tag, klass in tags.items()}]
+                for base, (field, tags) in self._unions.registered.items()
+            ]
+        except ValueError as e:
+            raise PymarshalError(f'Marshal configuration can not be exported: {e}')
+        return dict(self._options, delegates=paths, unions=unions, frozen=self._frozen)
+
+    @classmethod
+    def from_config(cls, config: dict):
         """
-        Convert a class instance to JSON formatted bytes
+        Build a Marshal from the output of `Marshal.config`
+        """
+        options = dict(config)
+        delegates = options.pop('delegates', [])
+        unions = options.pop('unions', [])
+        frozen = options.pop('frozen', False)
+        marshal = cls(**options)
+        for cls_path, delegate_path in delegates:
+            marshal.register_delegate(import_from_path(cls_path), import_from_path(delegate_path))
+        for base_path, field, tags in unions:
+            if tags is not None:
+                tags = {tag: import_from_path(path) for tag, path in tags.items()}
+            marshal.register_union(import_from_path(base_path), field, tags)
+        if frozen:
+            marshal.freeze()
+        return marshal
+
+    def __reduce__(self):
+        return self.__class__.from_config, (self.config(),)
+
+    @_SharedInstanceMethod
+    def marshal(self, obj, option: int = 0) -> bytes:
+        """
+        Convert a class instance to JSON formatted bytes, or to the format of the Marshal's codec
+
+        Only the fields declared in the class' `__init__` are written. Sets are written as sorted lists where possible
+        so the output is deterministic. May be called on the class itself, e.g. `Marshal.marshal(obj)`
         :param obj: The object to convert
+        :param option: orjson option flags passed through to `orjson.dumps`, e.g. `orjson.OPT_SORT_KEYS`.
+        With `orjson.OPT_PASSTHROUGH_DATACLASS` dataclasses are serialized from their init params as well. Ignored by
+        other codecs
         :return: bytes JSON representation of the class instance
         Example:
         >>> class Test:
@@ -118,13 +1181,55 @@ class Marshal:
         >>> print(data)
         '{name: foo}'
         """
-        return orjson.dumps(obj, default=_default)
+        if self._encoder.enum_by_name:
+            # orjson writes enums held by lists and dicts by value, user classes are handled by their encoders
+            obj = _nested_enum_names(obj)
+        return self._codec.dumps(obj, self._encoder.default, self._encoder.options(option, obj))
 
-    def unmarshal_str(self, cls, data: str):
+    @_SharedInstanceMethod
+    def marshal_stream(self, objs: typing.Iterable[typing.Any], fp, option: int = 0,
+                       buffer_size: int = streaming.DEFAULT_CHUNK_SIZE) -> int:
+        """
+        Write each object as a JSON Lines record to a binary file or socket, flushing in chunks of about `buffer_size`
+        bytes so the whole output is never held in memory
+        :param objs: The objects to convert
+        :param fp: A binary file object (anything with `write`) or a socket (anything with `sendall`)
+        :param option: orjson option flags, see `marshal`
+        :param buffer_size: Number of bytes buffered before writing to `fp`
+        :return: The number of records written
+
+        Example:
+
+        >>> with open('tests.ndjson', 'wb') as f:
+            >>> Marshal.marshal_stream(test_instances, f)
+        """
+        write = fp.sendall if hasattr(fp, 'sendall') else fp.write
+        dumps = orjson.dumps
+        default = self._encoder.default
+        options = self._encoder.options
+        option |= orjson.OPT_APPEND_NEWLINE
+        enum_by_name = self._encoder.enum_by_name
+        buffer = bytearray()
+        count = 0
+        for obj in objs:
+            if enum_by_name:
+                # See marshal, enums held by lists and dicts are otherwise written by value
+                obj = _nested_enum_names(obj)
+            buffer += dumps(obj, default=default, option=options(option, obj))
+            count += 1
+            if len(buffer) >= buffer_size:
+                write(buffer)
+                buffer = bytearray()
+        if buffer:
+            write(buffer)
+        return count
+
+    def unmarshal_str(self, cls, data: typing.Union[str, bytes, bytearray, memoryview, mmap.mmap, os.PathLike]):
         """
         Reconstruct an instance of type `cls` from a JSON formatted string
         :param cls: The class type. Must be a user defined type
-        :param data: The string JSON data
+        :param data: The JSON data as a str or any bytes-like object (bytes, bytearray, memoryview, mmap), which is
+        parsed in place without a str round trip. A path (os.PathLike, not str) is read with `unmarshal_file`
         :return: An instance of the class `cls`
 
         Example:
@@ -140,7 +1245,98 @@ class Marshal:
         >>> print(test_instance.name)
         'foo'
         """
-        return self.unmarshal(cls, orjson.loads(data))
+        cache = self._cache
+        if cache is not None and not isinstance(data, os.PathLike):
+            mode = self._cache_mode
+            share = mode == CACHE_SHARE or (mode == CACHE_AUTO and _is_immutable(cls))
+            return cache.lookup(cls, data, self._unmarshal_payload, share)
+        return self.unmarshal(cls, self._loads(data))
+
+    def _unmarshal_payload(self, cls, data):
+        return self.unmarshal(cls, self._loads(data))
+
+    def unmarshal_file(self, cls, path: typing.Union[str, os.PathLike]):
+        """
+        Reconstruct an instance of type `cls` from the JSON document in a file. The file is memory mapped and parsed in
+        place, so large documents are never copied into memory as bytes or str
+        :param cls: The class type. Must be a user defined type
+        :param path: Path of the file
+        :return: An instance of the class `cls`
+
+        Example:
+
+        >>> marshal = Marshal()
+        >>> test_instance = marshal.unmarshal_file(Test, 'test.json')
+        >>> print(test_instance.name)
+        'foo'
+        """
+        return self.unmarshal(cls, self._codec.load_file(path))
+
+    async def aunmarshal_str(self, cls, data, executor=None, threshold: int = DEFAULT_OFFLOAD_THRESHOLD):
+        """
+        Async variant of `unmarshal_str`. Payloads of at least `threshold` bytes, and paths, are decoded in `executor`
+        so the event loop isn't blocked, smaller payloads are decoded directly
+        :param cls: The class type. Must be a user defined type
+        :param data: The JSON data, see `unmarshal_str`
+        :param executor: The executor to decode in, by default the loop's default executor. A ProcessPoolExecutor
+        requires `cls` and any registered delegates to be importable, see `Marshal.config`
+        :param threshold: Payload size in bytes from which decoding is offloaded to `executor`
+        :return: An instance of the class `cls`
+
+        Example:
+
+        >>> marshal = Marshal()
+        >>> test_instance = await marshal.aunmarshal_str(Test, await request.read())
+        >>> print(test_instance.name)
+        'foo'
+        """
+        size = _payload_size(data)
+        if size is not None and size < threshold:
+            return self.unmarshal_str(cls, data)
+        return await _offload(executor, self.unmarshal_str, cls, data)
+
+    async def amarshal(self, obj, option: int = 0, executor=None) -> bytes:
+        """
+        Async variant of `marshal`, always running in `executor` as the size of the output isn't known up front.
+        Small objects are cheaper to marshal directly with `marshal`
+        :param obj: The object to convert
+        :param option: orjson option flags, see `marshal`
+        :param executor: The executor to marshal in, by default the loop's default executor
+        :return: bytes JSON representation of the object
+        """
+        return await _offload(executor, self.marshal, obj, option)
+
+    async def aunmarshal_stream(self, cls, source: typing.AsyncIterable[typing.Union[bytes, str]], array: bool = False,
+                                executor=None,
+                                threshold: int = DEFAULT_OFFLOAD_THRESHOLD) -> typing.AsyncIterator[typing.Any]:
+        """
+        Incrementally reconstruct `cls` instances from an async stream of JSON records, e.g. an aiohttp `StreamReader`.
+        The records completed by each chunk are decoded together, in `executor` once they add up to `threshold` bytes
+        :param cls: The class type. Must be a user defined type
+        :param source: An async iterable of bytes/str chunks
+        :param array: If True `source` holds a single top level JSON array, otherwise it holds JSON Lines
+        :param executor: See `aunmarshal_str`
+        :param threshold: See `aunmarshal_str`
+        :return: An async generator yielding an instance of `cls` per record
+
+        Example:
+
+        >>> marshal = Marshal()
+        >>> async for test_instance in marshal.aunmarshal_stream(Test, response.content):
+            >>> print(test_instance.name)
+        """
+        async for records in streaming.aiter_records(source, array):
+            if sum(len(record) for record in records) < threshold:
+                results = self._decode_records(cls, records)
+            else:
+                results = await _offload(executor, self._decode_records, cls, records)
+            for result in results:
+                yield result
+
+    def _decode_records(self, cls, records: typing.List[bytes]) -> list:
+        decode = self._arg_builder_factory.entry_for(cls)
+        loads = orjson.loads
+        return [decode(loads(record)) for record in records]
 
     def unmarshal(self, cls, data: dict):
         """
@@ -168,35 +1364,316 @@ class Marshal:
         except ValueError:
             raise ValueError(f'Failed to pymarshaler {data} to class {cls.__name__}')
 
+    def unmarshal_str_many(self, cls, data: typing.Union[str, bytes, bytearray, memoryview, mmap.mmap, os.PathLike],
+                           collect_errors: bool = False):
+        """
+        Reconstruct a list of `cls` instances from a JSON formatted array
+        :param cls: The class type. Must be a user defined type
+        :param data: The JSON array, see `unmarshal_str`
+        :param collect_errors: See `unmarshal_many`
+        :return: See `unmarshal_many`
+        """
+        return self.unmarshal_many(cls, self._loads(data), collect_errors)
+
+    def unmarshal_many(self, cls, items: typing.Iterable[dict], collect_errors: bool = False):
+        """
+        Reconstruct an instance of type `cls` from each item, resolving the decoder for `cls` only once for the batch
+        :param cls: The class type. Must be a user defined type
+        :param items: The parsed JSON objects
+        :param collect_errors: If False the first failing item aborts the batch. If True every item is attempted
+        :return: A list of `cls` instances. If `collect_errors` is True, a tuple of that list, with None in place of
+        every item that failed, and a list of (index, exception) pairs for the failed items
+
+        Example:
+
+        >>> marshal = Marshal()
+        >>> results, errors = marshal.unmarshal_many(Test, [{'name': 'foo'}, {}], collect_errors=True)
+        >>> print(results[0].name, errors[0][0])
+        'foo' 1
+        """
+        decode = self._arg_builder_factory.entry_for(cls)
+        if not collect_errors:
+            results = []
+            append = results.append
+            for index, item in enumerate(items):
+                try:
+                    append(decode(item))
+                except ValueError:
+                    raise ValueError(f'Failed to pymarshaler item {index} ({item}) to class {cls.__name__}')
+            return results
+
+        results = []
+        errors = []
+        for index, item in enumerate(items):
+            try:
+                results.append(decode(item))
+            except Exception as e:
+                results.append(None)
+                errors.append((index, e))
+        return results, errors
+
+    def unmarshal_stream(self, cls, source, array: bool = False,
+                         chunk_size: int = streaming.DEFAULT_CHUNK_SIZE) -> typing.Iterator[typing.Any]:
+        """
+        Lazily reconstruct `cls` instances from a stream of JSON records, holding only one record in memory at a time
+        :param cls: The class type. Must be a user defined type
+        :param source: A path, a binary or text file object, bytes or an iterable of bytes chunks
+        :param array: If True `source` holds a single top level JSON array, otherwise it holds JSON Lines
+        :param chunk_size: Number of bytes read from files at a time
+        :return: A generator yielding an instance of `cls` per record
+
+        Example:
+
+        >>> marshal = Marshal()
+        >>> for test_instance in marshal.unmarshal_stream(Test, 'tests.ndjson'):
+            >>> print(test_instance.name)
+        """
+        decode = self._arg_builder_factory.entry_for(cls)
+        for record in streaming.iter_records(source, array, chunk_size):
+            yield decode(orjson.loads(record))
+
+    def unmarshal_parallel(self, cls, records: typing.Iterable[typing.Any], executor=None, workers: int = None,
+                           chunk_size: int = parallel.DEFAULT_CHUNK_SIZE,
+                           ordered: bool = True) -> typing.Iterator[typing.Any]:
+        """
+        Decode a large batch of records across a process pool
+
+        Records are sent to the workers in chunks of `chunk_size`. Raw JSON records (bytes or str, e.g. the lines
+        yielded by `streaming.iter_records`) are parsed by the workers, so only the resulting instances are pickled.
+        Workers rebuild this Marshal from `Marshal.config`, so `cls` and any registered delegates must be importable
+        :param cls: The class type. Must be a user defined type defined at module level
+        :param records: Raw JSON records or already parsed dicts
+        :param executor: An executor to submit the chunks to. By default a ProcessPoolExecutor is created and shut down
+        :param workers: Number of worker processes when no executor is given
+        :param chunk_size: Number of records decoded per task
+        :param ordered: If True results are yielded in input order, otherwise as soon as their chunk completes
+        :return: A generator yielding an instance of `cls` per record
+
+        Example:
+
+        >>> marshal = Marshal()
+        >>> records = streaming.iter_records('tests.ndjson')
+        >>> for test_instance in marshal.unmarshal_parallel(Test, records, workers=8):
+            >>> print(test_instance.name)
+        """
+        return parallel.unmarshal_parallel(self, cls, records, executor, workers, chunk_size, ordered)
+
+    @property
+    def frozen(self) -> bool:
+        return self._frozen
+
+    def freeze(self, *classes):
+        """
+        Make this Marshal's configuration immutable, so it can be shared between threads with the guarantee that no
+        delegate or union is registered while it is in use. Decoding never takes a lock once the decoder of a class has
+        been compiled, so the classes given are compiled eagerly
+        :param classes: Classes to compile now rather than on their first use
+        :return: This Marshal
+
+        Example:
+
+        >>> marshal = Marshal().freeze(Test)
+        >>> marshal.register_delegate(Test, TestDelegate)
+        PymarshalError: Can not register on a frozen Marshal, register on a copy() instead
+        """
+        self._frozen = True
+        for cls in classes:
+            self.compile(cls)
+        return self
+
+    def copy(self):
+        """
+        Build an unfrozen Marshal with the same options, registered delegates and unions. Registering on the copy
+        leaves this Marshal untouched
+        :return: The new Marshal
+        """
+        marshal = self.__class__(**self._options)
+        for cls, delegate in self._arg_builder_factory.registered_delegates().items():
+            marshal.register_delegate(cls, delegate)
+        for base, (field, tags) in self._unions.registered.items():
+            marshal.register_union(base, field, tags)
+        return marshal
+
+    @property
+    def stats(self) -> typing.Optional[DecodeStats]:
+        """
+        The decode statistics being recorded, or None if they are disabled
+        """
+        return self._arg_builder_factory.stats
+
+    def enable_stats(self, stats: DecodeStats = None) -> DecodeStats:
+        """
+        Record decode counts, errors and timings per type, per field and per kind of decoder. Every converter is wrapped
+        to time it, which slows decoding down, so only enable this while investigating. Disabled stats cost nothing
+        :param stats: The collector to record into, e.g. one shared between several Marshals. A new one by default
+        :return: The collector, see `DecodeStats.as_dict`
+
+        Example:
+
+        >>> marshal = Marshal()
+        >>> stats = marshal.enable_stats()
+        >>> marshal.unmarshal(Outter, data)
+        >>> print(stats.as_dict()['kinds']['list']['count'])
+        1
+        """
+        if stats is None:
+            stats = DecodeStats()
+        self._arg_builder_factory.set_stats(stats)
+        return stats
+
+    def disable_stats(self):
+        """
+        Stop recording decode statistics, removing the timing wrappers
+        """
+        self._arg_builder_factory.set_stats(None)
+
+    @property
+    def cache(self) -> typing.Optional[ResultCache]:
+        """
+        The cache of `unmarshal_str` results, or None if it is disabled
+        """
+        return self._cache
+
+    def enable_cache(self, max_entries: int = 1024, max_bytes: typing.Optional[int] = None,
+                     ttl: typing.Optional[float] = None, mode: str = CACHE_AUTO) -> ResultCache:
+        """
+        Cache the results of `unmarshal_str` by target class and payload hash, so payloads decoded before, such as
+        reference data or feature flags read again and again, are only parsed and decoded once
+        :param max_entries: Maximum number of cached results, the least recently used being evicted first
+        :param max_bytes: Maximum total size of the cached payloads. Larger payloads are never cached. Unbounded by
+        default
+        :param ttl: Seconds a result stays cached after it was decoded. Forever by default
+        :param mode: CACHE_AUTO to return the cached instance itself for deeply immutable classes (frozen
+        dataclasses, NamedTuples, tuples, ... whose fields and items are all immutable) and a copy otherwise,
+        CACHE_SHARE to always return the cached instance, which callers must then never mutate, or CACHE_COPY to always
+        return a copy. Copies rebuild the mutable objects, lists and
+        dicts but share strings, numbers and other immutable values, see `cache.clone`. A copy costs roughly a third to
+        a half of decoding again, so prefer CACHE_SHARE whenever the results are only read
+        :return: The cache, see `ResultCache.as_dict` for its hit and miss counters
+
+        Example:
+
+        >>> marshal = Marshal()
+        >>> cache = marshal.enable_cache(max_entries=128, ttl=60)
+        >>> flags = marshal.unmarshal_str(Flags, data)
+        >>> flags = marshal.unmarshal_str(Flags, data)
+        >>> print(cache.as_dict()['hits'])
+        1
+        """
+        if max_entries < 1:
+            raise PymarshalError(f'max_entries must be a positive number of entries, got {max_entries}')
+        if mode not in CACHE_MODES:
+            raise PymarshalError(f'Unknown cache mode {mode}, expected one of {CACHE_MODES}')
+        self._cache_mode = mode
+        self._cache = ResultCache(max_entries, max_bytes, ttl)
+        return self._cache
+
+    def disable_cache(self):
+        """
+        Stop caching `unmarshal_str` results, dropping the cached ones
+        """
+        self._cache = None
+
+    def _clear_cache(self):
+        if self._cache is not None:
+            self._cache.clear()
+
+    def _check_not_frozen(self):
+        if self._frozen:
+            raise PymarshalError('Can not register on a frozen Marshal, register on a copy() instead')
+
     def register_delegate(self, cls, delegate_cls):
+        self._check_not_frozen()
         self._arg_builder_factory.register(cls, delegate_cls)
+        self._clear_cache()
 
-    def _unmarshal(self, cls, data: dict):
-        init_params = inspect.signature(cls.__init__).parameters
-        args = self._arg_builder_factory.resolve(cls, data)
-        if is_user_defined(type(args)):
-            result = args
-        else:
-            missing = _get_unsatisfied_args(args, init_params)
-            if len(missing) > 0:
-                unfilled = [key for key, param in missing.items() if param.default is inspect.Parameter.empty]
-                if len(unfilled) > 0:
-                    raise MissingFieldsError(f'Missing required field(s): {", ".join(unfilled)}')
-            result = cls(**args)
-        if 'validate' in dir(cls):
-            result.validate()
-        return result
+    def register_union(self, base, field: str = 'type', tags: typing.Optional[dict] = None):
+        """
+        Decode values declared as `base` (or one of its subclasses) to the concrete subclass named by the tag held in
+        the `field` key of the data. When marshaling, the tag is written to `field` unless the class already declares
+        a field of that name. The same can be declared on the class itself with `unions.tagged_union`
+        :param base: The root class of the union
+        :param field: Name of the discriminator field
+        :param tags: Mapping of tag to concrete class. By default every subclass of `base` (and `base` itself) is tagged
+        with the default of its own `field` class attribute if it has one, otherwise with its class name
+        :return: None
 
-    def _apply_typing(self, param_type, value: typing.Any) -> typing.Any:
-        result = self._arg_builder_factory.resolve(param_type, value)
-        if is_user_defined(param_type):
-            return param_type(**result)
-        return result
+        Example:
+
+        >>> @dataclass
+        >>> class Shape:
+            >>> pass
+
+        >>> @dataclass
+        >>> class Circle(Shape):
+            >>> radius: float
+
+        >>> marshal = Marshal()
+        >>> marshal.register_union(Shape, field='kind')
+        >>> print(marshal.unmarshal(Shape, {'kind': 'Circle', 'radius': 1.0}))
+        Circle(radius=1.0)
+        """
+        self._check_not_frozen()
+        self._arg_builder_factory.register_union(base, field, tags)
+        self._encoder.invalidate()
+        self._clear_cache()
+
+    def update(self, instance, data: dict, list_mode: str = UPDATE_REPLACE, dict_mode: str = UPDATE_REPLACE):
+        """
+        Apply a partial update to an existing instance, decoding only the fields present in `data`
+
+        Nested objects present in `data` are updated recursively rather than rebuilt, so the cost scales with the size
+        of the update, not of the instance. Mutable objects are updated in place. Frozen dataclasses and NamedTuples
+        are copied with the updated fields, so use the returned object
 
+        Updates are atomic: every value is decoded before anything is changed, and the changes are undone if a
+        `validate` hook fails, so on error `instance` is left exactly as it was
+        :param instance: The object to update
+        :param data: The partial JSON object, or JSON formatted str/bytes
+        :param list_mode: UPDATE_REPLACE to replace lists with the decoded ones, or UPDATE_APPEND to extend them
+        :param dict_mode: UPDATE_REPLACE to replace dicts with the decoded ones, or UPDATE_MERGE to merge the given keys
+        into them like a JSON Merge Patch (RFC 7386): nested values are updated recursively and null removes a key
+        :return: The updated instance
 
-def _get_unsatisfied_args(current_args: dict, all_params: dict):
-    return {k: v for (k, v) in all_params.items() if k not in current_args and _is_valid_missing(k)}
+        Example:
 
+        >>> marshal = Marshal()
+        >>> outter = marshal.unmarshal(Outter, data)
+        >>> marshal.update(outter, {'inner': {'value': 2}})
+        >>> print(outter.inner.value)
+        2
+        """
+        if list_mode not in (UPDATE_REPLACE, UPDATE_APPEND):
+            raise PymarshalError(f'Unknown list_mode {list_mode}')
+        if dict_mode not in (UPDATE_REPLACE, UPDATE_MERGE):
+            raise PymarshalError(f'Unknown dict_mode {dict_mode}')
+        if not isinstance(data, dict):
+            data = self._loads(data)
+        return self._arg_builder_factory.update(instance, data, list_mode, dict_mode)
 
-def _is_valid_missing(k: str) -> bool:
-    return k != 'self' and k != 'args' and k != 'kwargs'
+    def compile(self, cls) -> typing.Callable[[dict], typing.Any]:
+        """
+        Eagerly build the decoder for `cls` so the first unmarshal call doesn't pay for it
+        :param cls: The class type. Must be a user defined type
+        :return: A function converting raw JSON data into an instance of `cls`
+
+        Example:
+
+        >>> marshal = Marshal(codegen=True)
+        >>> decode = marshal.compile(Test)
+        >>> test_instance = decode({'name': 'foo'})
+        >>> print(test_instance.name)
+        'foo'
+        """
+        return self._arg_builder_factory.entry_for(cls)
+
+    def _loads(self, data):
+        if isinstance(data, os.PathLike):
+            return self._codec.load_file(data)
+        if isinstance(data, mmap.mmap):
+            with memoryview(data) as view:
+                return self._codec.loads(view)
+        return self._codec.loads(data)
+
+    def _unmarshal(self, cls, data: dict):
+        return self._arg_builder_factory.entry_for(cls)(data)
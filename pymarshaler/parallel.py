@@ -0,0 +1,61 @@
+import collections
+import concurrent.futures
+import itertools
+import typing
+
+import orjson
+
+DEFAULT_CHUNK_SIZE = 1000
+
+_worker_marshals = {}
+
+
+def _worker_marshal(config: dict):
+    key = orjson.dumps(config, option=orjson.OPT_SORT_KEYS)
+    marshal = _worker_marshals.get(key)
+    if marshal is None:
+        from pymarshaler.marshal import Marshal
+        marshal = Marshal.from_config(config)
+        _worker_marshals[key] = marshal
+    return marshal
+
+
+def _decode_chunk(config: dict, cls, records: list) -> list:
+    decode = _worker_marshal(config).compile(cls)
+    loads = orjson.loads
+    return [decode(loads(record)) if isinstance(record, (bytes, bytearray, str)) else decode(record)
+            for record in records]
+
+
+def unmarshal_parallel(marshal, cls, records: typing.Iterable[typing.Any], executor=None, workers: int = None,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE, ordered: bool = True) -> typing.Iterator[typing.Any]:
+    """
+    Decode `records` in chunks across a process pool, see `Marshal.unmarshal_parallel`
+    """
+    config = marshal.config()
+    owns_executor = executor is None
+    if owns_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    max_pending = 2 * (workers or getattr(executor, '_max_workers', None) or 1)
+    records = iter(records)
+    pending = collections.deque()
+    try:
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if chunk:
+                pending.append(executor.submit(_decode_chunk, config, cls, chunk))
+            if pending and (len(pending) >= max_pending or not chunk):
+                if ordered:
+                    yield from pending.popleft().result()
+                else:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                        yield from future.result()
+            elif not chunk:
+                return
+    finally:
+        for future in pending:
+            future.cancel()
+        if owns_executor:
+            executor.shutdown()
@@ -0,0 +1,112 @@
+import threading
+import time
+import typing
+
+
+class _Counter:
+
+    __slots__ = ('kind', 'count', 'errors', 'time', 'self_time')
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.count = 0
+        self.errors = 0
+        self.time = 0.0
+        self.self_time = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'kind': self.kind,
+            'count': self.count,
+            'errors': self.errors,
+            'error_rate': self.errors / self.count if self.count else 0.0,
+            'time': self.time,
+            'self_time': self.self_time
+        }
+
+
+class DecodeStats:
+    """
+    Collects decode counts, errors and timings per target type, per field and per kind of decoder
+    (user_defined, list, dict, datetime, registered, ...). See `Marshal.enable_stats`
+
+    `time` is the cumulative time spent decoding a type including everything nested in it, `self_time` excludes the
+    time spent in nested types, so the largest `self_time` points at the type actually responsible for slow decoding
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._types = {}
+        self._fields = {}
+
+    def wrap(self, name: str, kind: str, convert, fields: bool = False) -> typing.Callable[[typing.Any], typing.Any]:
+        """
+        Wrap a converter so each call is recorded under `name`
+        :param name: The type (or `Class.field`) name the calls are recorded under
+        :param kind: The kind of decoder
+        :param convert: The converter
+        :param fields: Whether `name` is a field rather than a type
+        :return: The timed converter
+        """
+        table = self._fields if fields else self._types
+        local = self._local
+        perf_counter = time.perf_counter
+
+        def timed(data):
+            outer_children = getattr(local, 'children', 0.0)
+            local.children = 0.0
+            failed = False
+            start = perf_counter()
+            try:
+                return convert(data)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                elapsed = perf_counter() - start
+                children = local.children
+                local.children = outer_children + elapsed
+                self._record(table, name, kind, elapsed, elapsed - children, failed)
+        timed.__wrapped__ = convert
+        return timed
+
+    def _record(self, table: dict, name: str, kind: str, elapsed: float, self_time: float, failed: bool):
+        with self._lock:
+            counter = table.get(name)
+            if counter is None:
+                counter = table[name] = _Counter(kind)
+            counter.count += 1
+            counter.errors += failed
+            counter.time += elapsed
+            counter.self_time += self_time
+
+    def reset(self):
+        with self._lock:
+            self._types = {}
+            self._fields = {}
+
+    def as_dict(self) -> dict:
+        """
+        Export the statistics as plain data, e.g. for a metrics pipeline
+        :return: A dict with `types` and `fields` tables, each mapping a name to its counters, and a `kinds` table
+        aggregating the types by kind of decoder
+
+        Example:
+
+        >>> stats = marshal.enable_stats()
+        >>> marshal.unmarshal(Test, {'name': 'foo'})
+        >>> print(stats.as_dict()['types']['Test'])
+        {'kind': 'user_defined', 'count': 1, 'errors': 0, 'error_rate': 0.0, 'time': 1.2e-05, 'self_time': 8e-06}
+        """
+        with self._lock:
+            types = {name: counter.as_dict() for name, counter in self._types.items()}
+            fields = {name: counter.as_dict() for name, counter in self._fields.items()}
+        kinds = {}
+        for counters in types.values():
+            totals = kinds.setdefault(counters['kind'], {'count': 0, 'errors': 0, 'time': 0.0, 'self_time': 0.0})
+            for key in totals:
+                totals[key] += counters[key]
+        for totals in kinds.values():
+            totals['error_rate'] = totals['errors'] / totals['count'] if totals['count'] else 0.0
+        return {'types': types, 'fields': fields, 'kinds': kinds}
@@ -0,0 +1,212 @@
+import os
+import re
+import typing
+
+from pymarshaler.errors import PymarshalError
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+_STRUCTURAL = re.compile(rb'[][{}",]')
+_STRING_END = re.compile(rb'["\\]')
+_WHITESPACE = b' \t\r\n'
+
+
+def iter_chunks(source, chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.Iterator[bytes]:
+    """
+    Read `source` as a sequence of byte chunks
+    :param source: A path (str or os.PathLike), a binary or text file object, a bytes-like object
+    or an iterable of bytes/str chunks
+    :param chunk_size: Number of bytes/characters read from files at a time
+    :return: An iterator of bytes chunks
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter_chunks(f, chunk_size)
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk.encode() if isinstance(chunk, str) else chunk
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield source if isinstance(source, bytes) else bytes(source)
+    else:
+        for chunk in source:
+            yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+class _LineSplitter:
+    """
+    Incrementally splits a stream of chunks into JSON Lines records, skipping blank lines
+    """
+
+    def __init__(self):
+        # Pieces of the unfinished last line, joined once its newline arrives
+        self._pending = []
+
+    def feed(self, chunk: bytes) -> typing.List[bytes]:
+        chunk = bytes(chunk)
+        if b'\n' not in chunk:
+            if chunk:
+                self._pending.append(chunk)
+            return []
+        lines = chunk.split(b'\n')
+        if self._pending:
+            self._pending.append(lines[0])
+            lines[0] = b''.join(self._pending)
+        self._pending = [lines.pop()]
+        return [line for line in lines if line.strip()]
+
+    def close(self) -> typing.List[bytes]:
+        pending = b''.join(self._pending)
+        self._pending = []
+        return [pending] if pending.strip() else []
+
+
+def iter_lines(chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+    """
+    Split a stream of chunks into JSON Lines records, skipping blank lines
+    """
+    splitter = _LineSplitter()
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.close()
+
+
+class _ArraySplitter:
+    """
+    Incrementally finds the boundaries of the elements of a top level JSON array without parsing them
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+        self._opened = False
+        # Whether an element has been followed by a comma, so the array can't end without another element
+        self._separated = False
+        self.closed = False
+
+    def feed(self, chunk: bytes) -> typing.List[bytes]:
+        buffer = self._buffer
+        buffer += chunk
+        items = []
+        pos = self._pos
+        depth = self._depth
+        in_string = self._in_string
+        while not self.closed:
+            if not self._opened:
+                while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                    pos += 1
+                if pos == len(buffer):
+                    break
+                if buffer[pos] != ord('['):
+                    raise PymarshalError('Expected a top level JSON array')
+                self._opened = True
+                pos += 1
+                self._start = pos
+            elif in_string:
+                match = _STRING_END.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                if match.group() == b'\\':
+                    if match.end() >= len(buffer):
+                        # The escaped character hasn't arrived yet
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                else:
+                    in_string = False
+                    pos = match.end()
+            else:
+                match = _STRUCTURAL.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                char = buffer[match.start()]
+                pos = match.end()
+                if char == ord('"'):
+                    in_string = True
+                elif char in b'[{':
+                    depth += 1
+                elif char in b']}':
+                    if depth == 0:
+                        if char != ord(']'):
+                            raise PymarshalError('Unexpected } in the top level JSON array')
+                        item = bytes(buffer[self._start:match.start()]).strip()
+                        if item:
+                            items.append(item)
+                        elif self._separated:
+                            raise PymarshalError('Missing element after the last comma of the JSON array')
+                        self.closed = True
+                    else:
+                        depth -= 1
+                elif depth == 0:
+                    item = bytes(buffer[self._start:match.start()]).strip()
+                    if not item:
+                        raise PymarshalError('Missing element before a comma of the JSON array')
+                    items.append(item)
+                    self._separated = True
+                    self._start = pos
+
+        if self.closed:
+            # Only whitespace may follow the array
+            if any(byte not in _WHITESPACE for byte in buffer[pos:]):
+                raise PymarshalError('Unexpected data after the top level JSON array')
+            self._start = pos = len(buffer)
+        if self._start > 0:
+            del buffer[:self._start]
+            pos -= self._start
+            self._start = 0
+        self._pos = pos
+        self._depth = depth
+        self._in_string = in_string
+        return items
+
+    def close(self) -> typing.List[bytes]:
+        if not self.closed:
+            raise PymarshalError('Unexpected end of stream while reading a JSON array')
+        return []
+
+
+def iter_array_items(chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+    """
+    Split a stream of chunks holding a single top level JSON array into the raw bytes of each element
+    """
+    splitter = _ArraySplitter()
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    splitter.close()
+
+
+async def aiter_records(source: typing.AsyncIterable[typing.Union[bytes, str]],
+                        array: bool = False) -> typing.AsyncIterator[typing.List[bytes]]:
+    """
+    Read the raw bytes of the records in an async stream of chunks, e.g. an aiohttp `StreamReader`
+    :param source: An async iterable of bytes/str chunks
+    :param array: If True `source` holds a single top level JSON array, otherwise it holds JSON Lines
+    :return: An async iterator of the list of complete records found in each chunk
+    """
+    splitter = _ArraySplitter() if array else _LineSplitter()
+    async for chunk in source:
+        records = splitter.feed(chunk.encode() if isinstance(chunk, str) else chunk)
+        if records:
+            yield records
+    records = splitter.close()
+    if records:
+        yield records
+
+
+def iter_records(source, array: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.Iterator[bytes]:
+    """
+    Read the raw bytes of each record in `source`
+    :param source: See `iter_chunks`
+    :param array: If True `source` holds a single top level JSON array, otherwise it holds JSON Lines
+    :param chunk_size: See `iter_chunks`
+    :return: An iterator of the raw bytes of each record
+    """
+    chunks = iter_chunks(source, chunk_size)
+    return iter_array_items(chunks) if array else iter_lines(chunks)
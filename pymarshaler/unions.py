@@ -0,0 +1,126 @@
+import inspect
+import typing
+
+from pymarshaler.errors import PymarshalError
+from pymarshaler.lazy import is_lazy_class, origin_of
+
+_UNION_ATTRIBUTE = '__pymarshaler_union__'
+_declared = False
+
+
+def tagged_union(field: str = 'type', tags: typing.Optional[dict] = None):
+    """
+    Class decorator declaring a base class as the root of a tagged union for every Marshal. See
+    `Marshal.register_union` for the meaning of the arguments
+
+    Example:
+
+    >>> @tagged_union(field='kind')
+    >>> @dataclass
+    >>> class Event:
+        >>> pass
+
+    >>> @dataclass
+    >>> class Click(Event):
+        >>> x: int
+
+    >>> print(Marshal().unmarshal(Event, {'kind': 'Click', 'x': 1}))
+    Click(x=1)
+    """
+    def wrapper(cls):
+        global _declared
+        setattr(cls, _UNION_ATTRIBUTE, (cls, field, tags))
+        _declared = True
+        return cls
+    return wrapper
+
+
+def any_declared() -> bool:
+    """
+    Whether `tagged_union` has been applied to any class
+    """
+    return _declared
+
+
+class TaggedUnions:
+    """
+    The tagged unions known to a Marshal, both registered on it and declared with `tagged_union`
+    """
+
+    def __init__(self):
+        self.registered = {}
+
+    def register(self, base, field: str, tags: typing.Optional[dict]):
+        if not inspect.isclass(base):
+            raise PymarshalError(f'Tagged union base must be a class, got {base}')
+        registered = dict(self.registered)
+        registered[base] = (field, tags)
+        self.registered = registered
+
+    def union_for(self, cls) -> typing.Optional[typing.Tuple[type, str, typing.Optional[dict]]]:
+        """
+        Returns the (base, field, tags) of the closest tagged union `cls` belongs to, or None
+        """
+        if not inspect.isclass(cls):
+            return None
+        cls = origin_of(cls)
+        registered = self.registered
+        for klass in cls.__mro__:
+            if klass in registered:
+                field, tags = registered[klass]
+                return klass, field, tags
+            declared = klass.__dict__.get(_UNION_ATTRIBUTE)
+            if declared is not None and declared[0] is klass:
+                return declared
+        return None
+
+    def field_for(self, cls) -> typing.Optional[str]:
+        union = self.union_for(cls)
+        return union[1] if union is not None else None
+
+    def index_for(self, cls) -> typing.Optional[typing.Tuple[str, dict]]:
+        """
+        Returns the discriminator field and the tag -> class index of every class a value typed as `cls` may hold
+        """
+        union = self.union_for(cls)
+        if union is None:
+            return None
+        base, field, tags = union
+        if tags is None:
+            tags = {tag_of(klass, field): klass for klass in _subclasses(base) if not inspect.isabstract(klass)}
+        return field, {tag: klass for tag, klass in tags.items() if issubclass(klass, cls)}
+
+    def tag_for(self, cls) -> typing.Optional[typing.Tuple[str, typing.Any]]:
+        """
+        Returns the discriminator field and tag written for instances of `cls`, or None if it isn't part of a union
+        """
+        union = self.union_for(cls)
+        if union is None:
+            return None
+        base, field, tags = union
+        if tags is None:
+            return field, tag_of(cls, field)
+        for tag, klass in tags.items():
+            if klass is cls:
+                return field, tag
+        raise PymarshalError(f'No tag registered for {cls.__name__} in the tagged union of {base.__name__}')
+
+
+def tag_of(cls, field: str):
+    """
+    The default tag of a class: the value of its `field` class attribute (e.g. a dataclass field default) if that is
+    a string or int, otherwise the class name. Inherited values are ignored so every subclass gets its own tag
+    """
+    tag = cls.__dict__.get(field)
+    return tag if isinstance(tag, (str, int)) and not isinstance(tag, bool) else cls.__name__
+
+
+def _subclasses(base) -> list:
+    result = [base]
+    for subclass in base.__subclasses__():
+        if is_lazy_class(subclass):
+            continue
+        for klass in _subclasses(subclass):
+            if klass not in result:
+                result.append(klass)
+    return result
@@ -1,7 +1,14 @@
+import dataclasses
 import datetime
+import importlib
 import inspect
-
+import threading
+import types
 import typing
+import weakref
+
+
+DATETIME_TYPES = (datetime.datetime, datetime.date, datetime.time, datetime.timedelta)
 
 
 def is_user_defined(cls, ignore=None) -> bool:
@@ -29,12 +36,40 @@ def is_user_defined(cls, ignore=None) -> bool:
         ignore = {}
     return cls is not None \
         and inspect.isclass(cls) \
-        and cls is not datetime.datetime \
+        and cls not in DATETIME_TYPES \
         and cls is not inspect.Parameter.empty \
         and cls.__module__ != 'builtins' \
         and cls not in ignore
 
 
+def get_origin(tp):
+    """
+    Returns the unsubscripted version of a generic type, e.g. `list` for `typing.List[int]` or `list[int]`, and
+    `typing.Union` for both `typing.Optional[int]` and `int | None`. None for anything that isn't a generic type
+    """
+    if _get_origin is not None:
+        origin = _get_origin(tp)
+    else:
+        origin = getattr(tp, '__origin__', None)
+    if _UnionType is not None and origin is _UnionType:
+        return typing.Union
+    return origin
+
+
+def get_args(tp) -> tuple:
+    """
+    Returns the type arguments of a generic type, e.g. `(int, str)` for `typing.Dict[int, str]`
+    """
+    if _get_args is not None:
+        return _get_args(tp)
+    return getattr(tp, '__args__', ())
+
+
+_get_origin = getattr(typing, 'get_origin', None)
+_get_args = getattr(typing, 'get_args', None)
+_UnionType = getattr(types, 'UnionType', None)
+
+
 def is_builtin(cls) -> bool:
     try:
         return cls.__module__ == 'builtins'
@@ -42,10 +77,119 @@ def is_builtin(cls) -> bool:
         return False
 
 
+class ClassMetadata:
+    """
+    Reflection results for a class, computed once by `get_class_metadata`
+    """
+
+    __slots__ = ('hints', 'signature', 'params', 'fields', 'attributes', 'required', 'defaults', 'has_validate')
+
+    def __init__(self, cls):
+        self.hints = typing.get_type_hints(cls)
+        self.signature = inspect.signature(cls.__init__ if not is_namedtuple(cls) else cls)
+        # Name of the attribute holding each init param, they only differ for attrs' private attributes
+        self.attributes = {}
+        if dataclasses.is_dataclass(cls):
+            self.params = {f.name: self.hints.get(f.name, f.type) for f in dataclasses.fields(cls) if f.init}
+        elif is_attrs_class(cls):
+            self.params = {}
+            for attribute in cls.__attrs_attrs__:
+                if attribute.init:
+                    name = getattr(attribute, 'alias', None) or attribute.name.lstrip('_')
+                    self.params[name] = self.hints.get(attribute.name, attribute.type)
+                    self.attributes[name] = attribute.name
+        elif self.hints:
+            self.params = dict(self.hints)
+        else:
+            # Resolves string annotations, e.g. under `from __future__ import annotations`
+            init_hints = typing.get_type_hints(cls.__init__) if inspect.isfunction(cls.__init__) else {}
+            self.params = {k: init_hints.get(k, v.annotation) for k, v in self.signature.parameters.items()}
+        self.fields = tuple(k for k in self.params if _is_field_name(k))
+        self.attributes = {k: self.attributes.get(k, k) for k in self.fields}
+        init_params = [
+            param for param in self.signature.parameters.values()
+            if _is_field_name(param.name) and param.kind not in (param.VAR_POSITIONAL, param.VAR_KEYWORD)
+        ]
+        self.required = tuple(param.name for param in init_params if param.default is inspect.Parameter.empty)
+        self.defaults = {param.name: param.default for param in init_params
+                         if param.default is not inspect.Parameter.empty}
+        self.has_validate = 'validate' in dir(cls)
+
+
+_metadata_cache = weakref.WeakKeyDictionary()
+_metadata_lock = threading.Lock()
+
+
+def get_class_metadata(cls) -> ClassMetadata:
+    """
+    Returns the cached type hints, init signature, required params, defaults and validate hook of a class. Forward
+    references are resolved the first time a class is seen. Entries are dropped once the class itself is garbage
+    collected, unless its own type hints reference it
+    :param cls: The class type
+    :return: The ClassMetadata for `cls`. It is shared, so it must not be modified
+
+    Example:
+
+    >>> @dataclass
+    >>> class Test:
+        >>> name: str
+        >>> value: int = 1
+
+    >>> metadata = get_class_metadata(Test)
+    >>> print(metadata.required, metadata.defaults)
+    ('name',) {'value': 1}
+    """
+    try:
+        return _metadata_cache[cls]
+    except KeyError:
+        pass
+    metadata = ClassMetadata(cls)
+    with _metadata_lock:
+        return _metadata_cache.setdefault(cls, metadata)
+
+
+def is_namedtuple(cls) -> bool:
+    """
+    Returns whether `cls` is a `typing.NamedTuple` or `collections.namedtuple` class
+    """
+    return inspect.isclass(cls) and issubclass(cls, tuple) and hasattr(cls, '_fields')
+
+
+def is_attrs_class(cls) -> bool:
+    """
+    Returns whether `cls` is an attrs class. attrs itself doesn't need to be installed
+    """
+    return inspect.isclass(cls) and hasattr(cls, '__attrs_attrs__')
+
+
 def get_init_params(cls) -> dict:
-    params = typing.get_type_hints(cls)
-    if params and len(params) > 0:
-        return params
-    params = inspect.signature(cls.__init__).parameters
-    return {k: v.annotation for k, v in params.items()}
+    return dict(get_class_metadata(cls).params)
+
+
+def _is_field_name(k: str) -> bool:
+    return k != 'self' and k != 'args' and k != 'kwargs'
+
+
+def import_path(obj) -> str:
+    """
+    Returns the path `obj` can be re-imported from with `import_from_path`
+    :param obj: A module level class or function
+    :return: The import path in the form `module:qualified.name`
+
+    Example:
+
+    >>> print(import_path(datetime.datetime))
+    'datetime:datetime'
+    """
+    qualname = getattr(obj, '__qualname__', None)
+    if qualname is None or '<' in qualname:
+        raise ValueError(f'{obj} can not be imported by path, it must be defined at module level')
+    return f'{obj.__module__}:{qualname}'
+
 
+def import_from_path(path: str):
+    module_name, _, qualname = path.partition(':')
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    return obj
@@ -22,5 +22,6 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     install_requires=required,
+    extras_require={'msgpack': ['msgpack'], 'cbor': ['cbor2']},
     python_requires='>=3.7',
 )
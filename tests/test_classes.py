@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional, Union, Literal, Tuple, Sequence, Mapping, FrozenSet, Any, \
+    NewType, NamedTuple
+
+from pymarshaler.unions import tagged_union
 
 
 @dataclass
@@ -58,6 +61,12 @@ class ClassWithDict:
     d: Dict[str, Inner]
 
 
+@dataclass
+class ClassWithOptionalDict:
+
+    d: Optional[Dict[str, int]] = None
+
+
 @dataclass
 class ClassWithNestedDict:
 
@@ -97,3 +106,220 @@ class NestedDictList:
 
 class EnumClass(Enum):
     VAL = 0
+
+
+@dataclass
+class TreeNode:
+
+    value: int
+    children: List[TreeNode]
+
+
+class ClassWithPrivateState:
+
+    def __init__(self, name: str):
+        self.name = name
+        self._cache = {'computed': True}
+
+
+@dataclass
+class ClassWithNonInitField:
+
+    name: str
+    computed: int = field(init=False, default=0)
+
+
+def custom_delegate(data):
+    return ClassWithCustomDelegate()
+
+
+@dataclass
+class DelegatedBase:
+
+    name: str
+
+
+@dataclass
+class DelegatedChild(DelegatedBase):
+
+    pass
+
+
+@dataclass
+class ClassWithDelegatedList:
+
+    items: List[Inner]
+
+
+@dataclass
+class ClassWithTemporals:
+
+    date: datetime.date
+    time: datetime.time
+    delta: datetime.timedelta
+
+
+class Status(Enum):
+    ACTIVE = 'active'
+    INACTIVE = 'inactive'
+
+
+@dataclass
+class ClassWithEnums:
+
+    status: Status
+    history: List[Status]
+    by_region: Dict[Status, int]
+
+
+UserId = NewType('UserId', int)
+
+
+@dataclass
+class ClassWithTyping:
+
+    maybe: Optional[Inner]
+    either: Union[int, str, List[Inner]]
+    literal: Literal['a', 'b']
+    ids: Tuple[UserId, ...]
+    pair: Tuple[int, str]
+    sequence: Sequence[Inner]
+    mapping: Mapping[str, FrozenSet[int]]
+    anything: Any
+
+
+@tagged_union(field='kind')
+@dataclass
+class Shape:
+
+    name: str
+
+
+@dataclass
+class Circle(Shape):
+
+    radius: float
+
+
+@dataclass
+class Square(Shape):
+
+    kind: str = 'square'
+    side: float = 1.0
+
+
+@dataclass
+class Drawing:
+
+    shapes: List[Shape]
+    highlight: Optional[Shape]
+
+
+@dataclass
+class Animal:
+
+    name: str
+
+
+@dataclass
+class Dog(Animal):
+
+    good: bool
+
+
+@dataclass
+class Cat(Animal):
+
+    lives: int
+
+
+class SlotsInner:
+
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name: str, value: int):
+        self.name = name
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, SlotsInner) and (self.name, self.value) == (other.name, other.value)
+
+
+class Point(NamedTuple):
+
+    x: int
+    y: int = 0
+
+
+@dataclass
+class CompactRecord:
+
+    inner: SlotsInner
+    points: List[Point]
+    ids: List[int]
+    weights: Optional[List[float]]
+
+
+@dataclass
+class Primitives:
+
+    name: str
+    count: int
+    ratio: float
+    flag: bool
+    ids: List[int]
+    labels: Dict[str, str]
+
+
+@dataclass(frozen=True)
+class Country:
+
+    code: str
+    name: str
+
+
+@dataclass
+class Address:
+
+    street: str
+    status: str
+    country: Country
+    location: Tuple[float, float]
+
+
+@dataclass
+class Attachment:
+
+    name: str
+    content: bytes
+    created: datetime.datetime
+    tags: Set[str]
+
+
+@dataclass
+class ClassWithAny:
+
+    anything: Any
+
+
+@dataclass(frozen=True)
+class FrozenHolder:
+
+    inner: Inner
+
+
+class HolderTuple(NamedTuple):
+
+    inner: Inner
+
+
+@dataclass(frozen=True)
+class FrozenTags:
+
+    tags: List[str]
+
+
+@dataclass
+class Track:
+
+    points: Tuple[float, ...]
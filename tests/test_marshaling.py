@@ -1,10 +1,27 @@
+import array
+import asyncio
+import io
 import json
+import mmap
+import os
+import pathlib
+import pickle
+import sys
+import tempfile
+import threading
 import unittest
+import unittest.mock
+from dataclasses import dataclass
 
-from pymarshaler.errors import MissingFieldsError, UnknownFieldError
+import orjson
+import pytest
+
+from pymarshaler import arg_delegates, lazy
+from pymarshaler import cache as cache_module
+from pymarshaler.codecs import Codec
+from pymarshaler.errors import MissingFieldsError, UnknownFieldError, PymarshalError
 from pymarshaler.marshal import Marshal
 from tests.test_classes import *
-from tests.timed import timed
 
 marshal = Marshal()
 
@@ -28,7 +45,6 @@ class TestMarshalling(unittest.TestCase):
     def tearDown(self) -> None:
         marshal = Marshal()
 
-    @timed
     def test_set(self):
         set_outer = SetOuter(
             {Inner(f'Inner{i}', i) for i in range(10)}
@@ -36,19 +52,16 @@ class TestMarshalling(unittest.TestCase):
         result = _marshall_and_unmarshall(SetOuter, set_outer)
         self.assertEqual(set_outer, result)
 
-    @timed
     def test_not_futurized(self):
         test = TestNotFuturized('test')
         result = _marshall_and_unmarshall(TestNotFuturized, test)
         self.assertEqual(test, result)
 
-    @timed
     def test_simple_marshalling(self):
         inner = Inner("Inner", 10)
         inner_result = _marshall_and_unmarshall(Inner, inner)
         self.assertEqual(inner, inner_result)
 
-    @timed
     def test_nested_marshalling(self):
         inner = Inner("Inner", 10)
         inner_list = [Inner(f'Inner_{i}', i) for i in range(10)]
@@ -56,7 +69,6 @@ class TestMarshalling(unittest.TestCase):
         outter_result = _marshall_and_unmarshall(Outter, outter)
         self.assertEqual(outter, outter_result)
 
-    @timed
     def test_multi_nested(self):
         inner = Inner("Inner", 10)
         inner_list = [Inner(f'Inner_{i}', i) for i in range(10000)]
@@ -65,7 +77,6 @@ class TestMarshalling(unittest.TestCase):
         result = _marshall_and_unmarshall(MultiNestedOutter, multi_nested_outter)
         self.assertEqual(result, multi_nested_outter)
 
-    @timed
     def test_multi_nested_list(self):
         nested_list = MultiNestedList(
             [MultiNestedOutter(
@@ -77,19 +88,16 @@ class TestMarshalling(unittest.TestCase):
         result = _marshall_and_unmarshall(MultiNestedList, nested_list)
         self.assertEqual(result, nested_list)
 
-    @timed
     def test_datetime_marshalling(self):
         class_with_date = ClassWithDate(datetime.datetime.now())
         result = _marshall_and_unmarshall(ClassWithDate, class_with_date)
         self.assertEqual(class_with_date, result)
 
-    @timed
     def test_dict_marshalling(self):
         class_with_dict = ClassWithDict({'Test': Inner('inner', 1)})
         result = _marshall_and_unmarshall(ClassWithDict, class_with_dict)
         self.assertEqual(result, class_with_dict)
 
-    @timed
     def test_nested_dict_marshalling(self):
         nested_dict = ClassWithNestedDict(
             {
@@ -109,18 +117,15 @@ class TestMarshalling(unittest.TestCase):
         result = _marshall_and_unmarshall(ClassWithNestedDict, nested_dict)
         self.assertEqual(nested_dict, result)
 
-    @timed
     def test_fails_on_missing(self):
         self.assertRaises(MissingFieldsError, lambda: marshal.unmarshal(Inner, {'name': 'Inner'}))
 
-    @timed
     def test_fails_on_unused(self):
         inner = Inner("Inner", 10)
         blob = json.loads(marshal.marshal(inner))
         blob['unused'] = 10
         self.assertRaises(UnknownFieldError, lambda: marshal.unmarshal(Inner, blob))
 
-    @timed
     def test_ignores_unused(self):
         marshal = Marshal(ignore_unknown_fields=True)
         inner = Inner("Inner", 10)
@@ -130,29 +135,24 @@ class TestMarshalling(unittest.TestCase):
         result = marshal.unmarshal(Inner, j)
         self.assertEqual(result, inner)
 
-    @timed
     def test_default_values(self):
         class_with_defaults = ClassWithDefaults()
         result = marshal.unmarshal(ClassWithDefaults, {})
         self.assertEqual(result, class_with_defaults)
 
-    @timed
     def test_validate(self):
         self.assertRaises(ValidateError, lambda: marshal.unmarshal(ClassWithValidate, {}))
 
-    @timed
     def test_custom_delegate(self):
         marshal.register_delegate(ClassWithCustomDelegate, lambda x: ClassWithCustomDelegate())
         result = marshal.unmarshal(ClassWithCustomDelegate, {})
         self.assertEqual(result, ClassWithCustomDelegate())
 
-    @timed
     def test_nested_lists(self):
         nested_lists = NestedList([[Inner("Inner_1", 1)], [Inner("Inner_2", 2)]])
         result = _marshall_and_unmarshall(NestedList, nested_lists)
         self.assertEqual(nested_lists, result)
 
-    @timed
     def test_nested_dict_list(self):
         nested = NestedDictList(
             {
@@ -164,7 +164,6 @@ class TestMarshalling(unittest.TestCase):
         result = _marshall_and_unmarshall(NestedDictList, nested)
         self.assertEqual(nested, result)
 
-    @timed
     def test_walk_unknown(self):
         marshal = Marshal(True, True)
         blob = {
@@ -173,12 +172,606 @@ class TestMarshalling(unittest.TestCase):
         result = marshal.unmarshal(Inner, blob)
         self.assertEqual(result, Inner('foo', 1))
 
-    @timed
     def test_enums(self):
         enum = EnumClass.VAL
         result = _marshall_and_unmarshall(EnumClass, enum)
         self.assertEqual(result, enum)
 
+    def test_recursive_type(self):
+        tree = TreeNode(0, [TreeNode(1, []), TreeNode(2, [TreeNode(3, [])])])
+        result = _marshall_and_unmarshall(TreeNode, tree)
+        self.assertEqual(tree, result)
+
+    def test_nested_missing_fields(self):
+        self.assertRaises(MissingFieldsError, lambda: marshal.unmarshal(Outter, {'inner': {}, 'inner_list': []}))
+
+    def test_compiled_plan_is_reused(self):
+        m = Marshal()
+        m.unmarshal(Inner, {'name': 'Inner', 'value': 1})
+        entry = m._arg_builder_factory.entry_for(Inner)
+        m.unmarshal(Inner, {'name': 'Inner', 'value': 2})
+        self.assertIs(entry, m._arg_builder_factory.entry_for(Inner))
+
+    def test_register_delegate_invalidates_plans(self):
+        m = Marshal()
+        self.assertEqual(m.unmarshal(Outter, {'inner': {'name': 'a', 'value': 1}, 'inner_list': []}).inner,
+                         Inner('a', 1))
+        m.register_delegate(Inner, lambda x: Inner('delegated', 0))
+        result = m.unmarshal(Outter, {'inner': {'name': 'a', 'value': 1}, 'inner_list': []})
+        self.assertEqual(result.inner, Inner('delegated', 0))
+
+    def test_codegen(self):
+        codegen_marshal = Marshal(codegen=True)
+        nested = NestedDictList({'Test1': {'Test2': NestedList([[Inner('test', 1)], [Inner('test', 2)]])}})
+        result = codegen_marshal.unmarshal_str(NestedDictList, Marshal.marshal(nested))
+        self.assertEqual(nested, result)
+        self.assertEqual(codegen_marshal.unmarshal(ClassWithDefaults, {}), ClassWithDefaults())
+
+    def test_codegen_errors(self):
+        codegen_marshal = Marshal(codegen=True)
+        self.assertRaises(UnknownFieldError,
+                          lambda: codegen_marshal.unmarshal(Inner, {'name': 'a', 'value': 1, 'unused': 1}))
+        self.assertRaises(MissingFieldsError, lambda: codegen_marshal.unmarshal(Inner, {'name': 'a'}))
+        walking = Marshal(True, True, codegen=True)
+        self.assertEqual(walking.unmarshal(Inner, {'blah': {'name': 'foo', 'blah2': {'value': 1}}}), Inner('foo', 1))
+
+    def test_compile(self):
+        decode = Marshal(codegen=True).compile(MultiNestedOutter)
+        result = decode({'outter': {'inner': {'name': 'a', 'value': 1}, 'inner_list': []}})
+        self.assertEqual(result, MultiNestedOutter(Outter(Inner('a', 1), [])))
+
+    def test_marshal_declared_fields_only(self):
+        self.assertEqual(orjson.loads(Marshal.marshal(ClassWithPrivateState('foo'))), {'name': 'foo'})
+        passthrough = Marshal.marshal(ClassWithNonInitField('foo'), option=orjson.OPT_PASSTHROUGH_DATACLASS)
+        self.assertEqual(orjson.loads(passthrough), {'name': 'foo'})
+
+    def test_marshal_set_is_deterministic(self):
+        self.assertEqual(Marshal.marshal({'c', 'a', 'b'}), b'["a","b","c"]')
+
+    def test_marshal_unsupported(self):
+        self.assertRaises(TypeError, lambda: Marshal.marshal(object()))
+
+    def test_unmarshal_many(self):
+        inners = [Inner(f'Inner_{i}', i) for i in range(100)]
+        self.assertEqual(marshal.unmarshal_str_many(Inner, Marshal.marshal(inners)), inners)
+
+    def test_unmarshal_many_collect_errors(self):
+        items = [{'name': 'a', 'value': 1}, {'name': 'b'}, {'name': 'c', 'value': 3}]
+        self.assertRaises(MissingFieldsError, lambda: marshal.unmarshal_many(Inner, items))
+        results, errors = marshal.unmarshal_many(Inner, items, collect_errors=True)
+        self.assertEqual(results, [Inner('a', 1), None, Inner('c', 3)])
+        self.assertEqual([index for index, _ in errors], [1])
+        self.assertIsInstance(errors[0][1], MissingFieldsError)
+
+    def test_unmarshal_stream_lines(self):
+        inners = [Inner(f'Inner_{i}', i) for i in range(50)]
+        blob = b'\n'.join(Marshal.marshal(inner) for inner in inners) + b'\n\n'
+        chunks = [blob[i:i + 7] for i in range(0, len(blob), 7)]
+        self.assertEqual(list(marshal.unmarshal_stream(Inner, chunks)), inners)
+        self.assertEqual(list(marshal.unmarshal_stream(Inner, [blob[i:i + 1] for i in range(len(blob))])), inners)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'inners.ndjson')
+            with open(path, 'wb') as f:
+                f.write(blob)
+            self.assertEqual(list(marshal.unmarshal_stream(Inner, path, chunk_size=16)), inners)
+
+    def test_unmarshal_stream_array(self):
+        inners = [Inner(f'Inner "[{{,\\ {i}', i) for i in range(50)]
+        blob = b' ' + Marshal.marshal(inners)
+        chunks = [blob[i:i + 1] for i in range(len(blob))]
+        self.assertEqual(list(marshal.unmarshal_stream(Inner, chunks, array=True)), inners)
+        self.assertEqual(list(marshal.unmarshal_stream(Inner, io.BytesIO(b'[]'), array=True)), [])
+        self.assertRaises(PymarshalError, lambda: list(marshal.unmarshal_stream(Inner, blob[:-1], array=True)))
+        self.assertEqual(list(marshal.unmarshal_stream(int, [b'[1, 2', b'] \n', b' '], array=True)), [1, 2])
+        for invalid in (b'[1,2,]', b'[1,,2]', b'[,1]', b'[1,2] xyz', b'[1,2]]', b'[1,2}'):
+            self.assertRaises(PymarshalError, lambda: list(marshal.unmarshal_stream(int, invalid, array=True)))
+            self.assertRaises(PymarshalError, lambda: list(marshal.unmarshal_stream(int, [invalid[:3], invalid[3:]],
+                                                                                    array=True)))
+
+    def test_marshal_stream(self):
+        inners = [Inner(f'Inner_{i}', i) for i in range(50)]
+        out = io.BytesIO()
+        self.assertEqual(Marshal.marshal_stream(inners, out, buffer_size=64), 50)
+        out.seek(0)
+        self.assertEqual(list(marshal.unmarshal_stream(Inner, out)), inners)
+
+    def test_config_round_trip(self):
+        configured = Marshal(ignore_unknown_fields=True, codegen=True)
+        configured.register_delegate(ClassWithCustomDelegate, custom_delegate)
+        copy = pickle.loads(pickle.dumps(configured))
+        self.assertEqual(copy.config(), configured.config())
+        self.assertEqual(copy.unmarshal(ClassWithCustomDelegate, {'ignored': 1}), ClassWithCustomDelegate())
+        unexportable = Marshal()
+        unexportable.register_delegate(ClassWithCustomDelegate, lambda x: ClassWithCustomDelegate())
+        self.assertRaises(PymarshalError, unexportable.config)
+
+    def test_unmarshal_parallel(self):
+        inners = [Inner(f'Inner_{i}', i) for i in range(100)]
+        records = [Marshal.marshal(inner) for inner in inners]
+        result = list(Marshal().unmarshal_parallel(Inner, records, workers=2, chunk_size=7))
+        self.assertEqual(result, inners)
+        dicts = [orjson.loads(record) for record in records]
+        result = Marshal().unmarshal_parallel(Inner, dicts, workers=2, chunk_size=7, ordered=False)
+        self.assertEqual(sorted(result, key=lambda inner: inner.value), inners)
+
+    def test_delegate_lookup_follows_mro(self):
+        m = Marshal()
+        m.register_delegate(DelegatedBase, lambda x: DelegatedBase('base'))
+        self.assertEqual(m.unmarshal(DelegatedChild, {'name': 'a'}), DelegatedBase('base'))
+        m.register_delegate(DelegatedChild, lambda x: DelegatedChild('child'))
+        self.assertEqual(m.unmarshal(DelegatedChild, {'name': 'a'}), DelegatedChild('child'))
+        self.assertEqual(m.unmarshal(DelegatedBase, {'name': 'a'}), DelegatedBase('base'))
+
+    def test_delegate_for_generic(self):
+        m = Marshal()
+        m.register_delegate(List[Inner], lambda x: [Inner(key, value) for key, value in x.items()])
+        result = m.unmarshal(ClassWithDelegatedList, {'items': {'a': 1}})
+        self.assertEqual(result, ClassWithDelegatedList([Inner('a', 1)]))
+        self.assertEqual(m.unmarshal(SetOuter, {'inner_set': [{'name': 'a', 'value': 1}]}), SetOuter({Inner('a', 1)}))
+
+    def test_datetime_formats(self):
+        utc = datetime.datetime(2021, 6, 1, 12, 30, 15, 123000, tzinfo=datetime.timezone.utc)
+        self.assertEqual(marshal.unmarshal(ClassWithDate, {'date': '2021-06-01T12:30:15.123Z'}), ClassWithDate(utc))
+        for datetime_format, raw in (('epoch', utc.timestamp()),
+                                     ('epoch_millis', 1622550615123),
+                                     ('%Y/%m/%d %H:%M:%S.%f', '2021/06/01 12:30:15.123000')):
+            m = Marshal(datetime_format=datetime_format)
+            expected = utc if datetime_format.startswith('epoch') else utc.replace(tzinfo=None)
+            self.assertEqual(orjson.loads(m.marshal(ClassWithDate(expected))), {'date': raw})
+            self.assertEqual(m.unmarshal(ClassWithDate, {'date': raw}), ClassWithDate(expected))
+        self.assertRaises(PymarshalError, lambda: Marshal(datetime_format='unknown'))
+
+    def test_date_time_timedelta(self):
+        temporals = ClassWithTemporals(datetime.date(2021, 6, 1), datetime.time(12, 30), datetime.timedelta(minutes=90))
+        self.assertEqual(orjson.loads(Marshal.marshal(temporals)),
+                         {'date': '2021-06-01', 'time': '12:30:00', 'delta': 5400.0})
+        self.assertEqual(_marshall_and_unmarshall(ClassWithTemporals, temporals), temporals)
+        m = Marshal(datetime_format='epoch')
+        self.assertEqual(m.unmarshal_str(ClassWithTemporals, m.marshal(temporals)), temporals)
+
+    def test_enum_by_value(self):
+        enums = ClassWithEnums(Status.ACTIVE, [Status.INACTIVE], {Status.ACTIVE: 1})
+        blob = {'status': 'active', 'history': ['inactive'], 'by_region': {'active': 1}}
+        self.assertEqual(marshal.unmarshal(ClassWithEnums, blob), enums)
+        self.assertRaises(UnknownFieldError, lambda: marshal.unmarshal(Status, 'ACTIVE'))
+        self.assertEqual(orjson.loads(marshal.marshal(enums)), blob)
+        self.assertEqual(_marshall_and_unmarshall(ClassWithEnums, enums), enums)
+
+    def test_enum_by_name(self):
+        m = Marshal(enum_by_name=True, enum_case_insensitive=True)
+        enums = ClassWithEnums(Status.ACTIVE, [Status.INACTIVE], {Status.ACTIVE: 1})
+        blob = orjson.loads(m.marshal(enums))
+        self.assertEqual(blob, {'status': 'ACTIVE', 'history': ['INACTIVE'], 'by_region': {'ACTIVE': 1}})
+        self.assertEqual(m.unmarshal(ClassWithEnums, blob), enums)
+        self.assertEqual(m.unmarshal(Status, 'inactive'), Status.INACTIVE)
+        self.assertEqual(m.marshal(Status.ACTIVE), b'"ACTIVE"')
+        self.assertRaises(UnknownFieldError, lambda: Marshal(enum_by_name=True).unmarshal(Status, 'active'))
+        self.assertEqual(m.unmarshal_str(List[Status], m.marshal([Status.ACTIVE])), [Status.ACTIVE])
+        self.assertEqual(m.marshal({'x': Status.ACTIVE, 'y': [ClassWithEnums(Status.ACTIVE, [], {})]}),
+                         b'{"x":"ACTIVE","y":[{"status":"ACTIVE","history":[],"by_region":{}}]}')
+        self.assertEqual(m.marshal(Point(1, 2)), b'{"x":1,"y":2}')
+        self.assertEqual(m.marshal(ClassWithAny({'a': [Status.INACTIVE]})), b'{"anything":{"a":["INACTIVE"]}}')
+        stream = io.BytesIO()
+        m.marshal_stream([[Status.ACTIVE], {'x': Status.INACTIVE}, enums], stream)
+        self.assertEqual(stream.getvalue().splitlines()[:2], [b'["ACTIVE"]', b'{"x":"INACTIVE"}'])
+        self.assertEqual(m.unmarshal_str(ClassWithEnums, stream.getvalue().splitlines()[2]), enums)
+
+    def test_legacy_delegates(self):
+        def func(cls, data):
+            return cls(data)
+        self.assertEqual(arg_delegates.tuple_delegate(Tuple[int, ...], ['1', 2, 3.0], func), (1, 2, 3))
+        self.assertEqual(arg_delegates.tuple_delegate(Tuple[int, str], ['1', 2], func), (1, '2'))
+        self.assertEqual(arg_delegates.list_delegate(List[int], ['1'], func), [1])
+        self.assertEqual(arg_delegates.dict_delegate(Dict[str, int], {1: '2'}, func), {'1': 2})
+        self.assertEqual(arg_delegates.user_defined_delegate(Inner, {'name': 'a', 'value': '1'}, func, False, False),
+                         {'name': 'a', 'value': 1})
+        self.assertRaises(UnknownFieldError,
+                          lambda: arg_delegates.user_defined_delegate(Inner, {'other': 1}, func, False, False))
+
+    def test_typing_coverage(self):
+        typed = ClassWithTyping(None, 'value', 'a', (UserId(1), UserId(2)), (1, 'one'), [Inner('a', 1)],
+                                {'k': frozenset({1, 2})}, {'free': ['form']})
+        result = _marshall_and_unmarshall(ClassWithTyping, typed)
+        self.assertEqual(result, typed)
+        self.assertIsInstance(result.mapping['k'], frozenset)
+        result = marshal.unmarshal(ClassWithTyping, dict(orjson.loads(Marshal.marshal(typed)),
+                                                         maybe={'name': 'a', 'value': 1},
+                                                         either=[{'name': 'b', 'value': 2}]))
+        self.assertEqual(result.maybe, Inner('a', 1))
+        self.assertEqual(result.either, [Inner('b', 2)])
+        self.assertEqual(marshal.unmarshal(Union[int, str], 3), 3)
+        self.assertRaises(UnknownFieldError, lambda: marshal.unmarshal(Union[int, str], 1.5))
+        self.assertRaises(UnknownFieldError, lambda: marshal.unmarshal(Literal['a', 'b'], 'c'))
+        self.assertRaises(ValueError, lambda: marshal.unmarshal(Tuple[int, str], [1, 'one', 2]))
+
+    @unittest.skipIf(sys.version_info < (3, 9), 'PEP 585 generics require Python 3.9')
+    def test_builtin_generics(self):
+        result = marshal.unmarshal(list[dict[str, Inner]], [{'a': {'name': 'a', 'value': 1}}])
+        self.assertEqual(result, [{'a': Inner('a', 1)}])
+        self.assertEqual(Marshal(codegen=True).unmarshal(tuple[int, ...], [1, 2, 3]), (1, 2, 3))
+
+    def test_tagged_union_decorator(self):
+        drawing = Drawing([Circle('c', 1.5), Square('s', side=2.0), Shape('plain')], Circle('h', 0.5))
+        blob = orjson.loads(Marshal.marshal(drawing))
+        self.assertEqual(blob['shapes'][0], {'kind': 'Circle', 'name': 'c', 'radius': 1.5})
+        self.assertEqual(blob['shapes'][1], {'name': 's', 'kind': 'square', 'side': 2.0})
+        for m in (marshal, Marshal(codegen=True)):
+            self.assertEqual(m.unmarshal(Drawing, blob), drawing)
+            self.assertEqual(m.unmarshal(Shape, {'name': 'untagged'}), Shape('untagged'))
+            self.assertEqual(m.unmarshal(Circle, {'kind': 'Circle', 'name': 'c', 'radius': 1}), Circle('c', 1))
+            self.assertRaises(UnknownFieldError, lambda: m.unmarshal(Shape, {'kind': 'Hexagon', 'name': 'h'}))
+            self.assertRaises(UnknownFieldError, lambda: m.unmarshal(Circle, {'kind': 'square', 'name': 's'}))
+
+        # Subclasses defined once the union was decoded still join it
+        @dataclass
+        class Triangle(Shape):
+
+            base: float
+
+        self.assertEqual(marshal.unmarshal(Drawing, {'shapes': [{'kind': 'Triangle', 'name': 't', 'base': 2}],
+                                                     'highlight': None}), Drawing([Triangle('t', 2.0)], None))
+
+        # Only objects which may hold union members stop orjson from writing dataclasses natively
+        passthrough = orjson.OPT_PASSTHROUGH_DATACLASS
+        self.assertFalse(marshal._encoder.options(0, [Outter(Inner('a', 1), [])]) & passthrough)
+        self.assertTrue(marshal._encoder.options(0, {'d': [[drawing]]}) & passthrough)
+        self.assertTrue(marshal._encoder.options(0, [Inner('a', 1), Circle('c', 1.5)]) & passthrough)
+        self.assertEqual(orjson.loads(Marshal.marshal({'d': [[Circle('c', 1.5)]]}))['d'][0][0]['kind'], 'Circle')
+
+    def test_register_union(self):
+        m = Marshal()
+        m.register_union(Animal, field='species', tags={'dog': Dog, 'cat': Cat})
+        animals = [Dog('rex', True), Cat('tom', 9)]
+        blob = m.marshal(animals)
+        self.assertEqual(orjson.loads(blob)[0], {'species': 'dog', 'name': 'rex', 'good': True})
+        self.assertEqual(m.unmarshal(List[Animal], orjson.loads(blob)), animals)
+        self.assertRaises(MissingFieldsError, lambda: m.unmarshal(Animal, {'name': 'rex'}))
+        self.assertEqual(pickle.loads(pickle.dumps(m)).unmarshal(Animal, {'species': 'cat', 'name': 'tom', 'lives': 9}),
+                         Cat('tom', 9))
+        self.assertRaises(UnknownFieldError, lambda: marshal.unmarshal(Animal, {'species': 'dog', 'name': 'rex'}))
+
+    def test_lazy(self):
+        outter = MultiNestedOutter(Outter(Inner('a', 1), [Inner('b', 2), Inner('c', 3)]))
+        blob = orjson.loads(Marshal.marshal(outter))
+        for m in (Marshal(lazy=True), Marshal(lazy=True, codegen=True)):
+            result = m.unmarshal(MultiNestedOutter, blob)
+            self.assertIsInstance(result, MultiNestedOutter)
+            self.assertIsInstance(result.__dict__['outter'], lazy.Pending)
+            self.assertEqual(result.outter.inner, Inner('a', 1))
+            self.assertIsInstance(result.outter.__dict__['inner_list'], lazy.Pending)
+            self.assertEqual(result, outter)
+            self.assertEqual(outter, result)
+            self.assertEqual(repr(result), repr(outter))
+            self.assertEqual(orjson.loads(Marshal.marshal(m.unmarshal(MultiNestedOutter, blob))), blob)
+            self.assertEqual(pickle.loads(pickle.dumps(m.unmarshal(MultiNestedOutter, blob))), outter)
+
+        result = Marshal(lazy=True).unmarshal(Outter, {'inner': {'name': 'a', 'value': 1}, 'inner_list': [{'bad': 1}]})
+        self.assertEqual(result.inner, Inner('a', 1))
+        self.assertRaises(UnknownFieldError, lambda: result.inner_list)
+
+    def test_zero_copy_inputs(self):
+        inner = Inner('a', 1)
+        blob = Marshal.marshal(inner)
+        for data in (blob, bytearray(blob), memoryview(blob), blob.decode()):
+            self.assertEqual(marshal.unmarshal_str(Inner, data), inner)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'inner.json')
+            with open(path, 'wb') as f:
+                f.write(blob)
+            self.assertEqual(marshal.unmarshal_file(Inner, path), inner)
+            self.assertEqual(marshal.unmarshal_str(Inner, pathlib.Path(path)), inner)
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                self.assertEqual(marshal.unmarshal_str(Inner, mapped), inner)
+            open(path, 'wb').close()
+            self.assertRaises(orjson.JSONDecodeError, lambda: marshal.unmarshal_file(Inner, path))
+
+    def test_async(self):
+        inners = [Inner(str(i), i) for i in range(100)]
+        blob = Marshal.marshal(inners[0])
+        stream = b''.join(Marshal.marshal(inner) + b'\n' for inner in inners)
+
+        async def chunks(data, size):
+            for i in range(0, len(data), size):
+                yield data[i:i + size]
+
+        async def collect(source, **kwargs):
+            return [x async for x in marshal.aunmarshal_stream(Inner, source, **kwargs)]
+
+        async def run():
+            self.assertEqual(await marshal.aunmarshal_str(Inner, blob), inners[0])
+            self.assertEqual(await marshal.aunmarshal_str(Inner, blob, threshold=0), inners[0])
+            self.assertEqual(orjson.loads(await marshal.amarshal(inners[0])), orjson.loads(blob))
+            self.assertEqual(await collect(chunks(stream, 7)), inners)
+            self.assertEqual(await collect(chunks(stream, 1000), threshold=0), inners)
+            self.assertEqual(await collect(chunks(Marshal.marshal(inners), 13), array=True), inners)
+
+        asyncio.run(run())
+
+    def test_freeze_and_copy(self):
+        frozen = Marshal().freeze(Outter)
+        self.assertTrue(frozen.frozen)
+        self.assertRaises(PymarshalError, lambda: frozen.register_delegate(Inner, custom_delegate))
+        self.assertRaises(PymarshalError, lambda: frozen.register_union(Animal))
+        copy = frozen.copy()
+        self.assertFalse(copy.frozen)
+        copy.register_delegate(Inner, custom_delegate)
+        self.assertEqual(copy.unmarshal(Inner, {}), custom_delegate({}))
+        self.assertEqual(frozen.unmarshal(Inner, {'name': 'a', 'value': 1}), Inner('a', 1))
+        self.assertTrue(pickle.loads(pickle.dumps(frozen)).frozen)
+
+    def test_concurrent_registration(self):
+        m = Marshal()
+        data = {'inner': {'name': 'a', 'value': 1}, 'inner_list': [{'name': 'b', 'value': 2}]}
+        errors = []
+
+        def decode():
+            try:
+                for _ in range(200):
+                    self.assertIsInstance(m.unmarshal(Outter, data), Outter)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=decode) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(200):
+            m.register_delegate(type(f'Registered{i}', (), {}), custom_delegate)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_slots_and_namedtuple(self):
+        record = CompactRecord(SlotsInner('a', 1), [Point(1, 2), Point(3)], [1, 2], None)
+        blob = orjson.loads(Marshal.marshal(record))
+        self.assertEqual(blob['inner'], {'name': 'a', 'value': 1})
+        self.assertEqual(blob['points'], [{'x': 1, 'y': 2}, {'x': 3, 'y': 0}])
+        for m in (marshal, Marshal(codegen=True)):
+            self.assertEqual(m.unmarshal(CompactRecord, blob), record)
+            self.assertEqual(m.unmarshal(Point, [5, '6']), Point(5, 6))
+            self.assertEqual(m.unmarshal(Point, [5]), Point(5))
+            self.assertRaises(UnknownFieldError, lambda: m.unmarshal(Point, [1, 2, 3]))
+            self.assertRaises(MissingFieldsError, lambda: m.unmarshal(Point, []))
+
+    @unittest.skipIf(sys.version_info < (3, 10), 'dataclass slots require Python 3.10')
+    def test_dataclass_slots(self):
+        @dataclass(slots=True)
+        class Slotted:
+            name: str
+            inner: Inner
+
+        slotted = Slotted('a', Inner('b', 1))
+        self.assertEqual(marshal.unmarshal_str(Slotted, Marshal.marshal(slotted)), slotted)
+        self.assertEqual(Marshal(lazy=True).unmarshal_str(Slotted, Marshal.marshal(slotted)), slotted)
+
+    def test_attrs(self):
+        attr = pytest.importorskip('attr')
+
+        @attr.s
+        class Private:
+            _name = attr.ib(type=str)
+            inner = attr.ib(type=Inner)
+
+        @attr.define
+        class Defined:
+            value: int
+            privates: List[Private] = attr.Factory(list)
+
+        defined = Defined(1, [Private('a', Inner('b', 2))])
+        blob = Marshal.marshal(defined)
+        self.assertEqual(orjson.loads(blob),
+                         {'value': 1, 'privates': [{'name': 'a', 'inner': {'name': 'b', 'value': 2}}]})
+        self.assertEqual(marshal.unmarshal_str(Defined, blob), defined)
+        self.assertEqual(Marshal(codegen=True).unmarshal_str(Defined, blob), defined)
+        self.assertEqual(marshal.unmarshal(Defined, {'value': 2}), Defined(2))
+
+    def test_numeric_arrays(self):
+        compact = Marshal(numeric_lists='array')
+        blob = {'inner': {'name': 'a', 'value': 1}, 'points': [], 'ids': [1, 2, 3], 'weights': [0.5, 1]}
+        for m in (compact, Marshal(numeric_lists='array', codegen=True)):
+            result = m.unmarshal(CompactRecord, blob)
+            self.assertEqual(result.ids, array.array('q', [1, 2, 3]))
+            self.assertEqual(result.weights, array.array('d', [0.5, 1.0]))
+            self.assertEqual(orjson.loads(Marshal.marshal(result)), dict(blob, weights=[0.5, 1.0]))
+        self.assertEqual(compact.unmarshal(List[int], [2 ** 70]), [2 ** 70])
+        self.assertEqual(compact.unmarshal(List[int], [1.0]), array.array('q', [1]))
+        self.assertRaises(PymarshalError, lambda: Marshal(numeric_lists='tensor'))
+
+    def test_stats(self):
+        for m in (Marshal(), Marshal(codegen=True)):
+            stats = m.enable_stats()
+            m.unmarshal(Outter, {'inner': {'name': 'a', 'value': 1}, 'inner_list': [{'name': 'b', 'value': 2}] * 3})
+            self.assertRaises(ValueError, lambda: m.unmarshal(Inner, {'name': 'a', 'value': 'x'}))
+            exported = stats.as_dict()
+            self.assertEqual(exported['types']['Outter']['count'], 1)
+            self.assertEqual(exported['types']['Inner']['count'], 5)
+            self.assertEqual(exported['types']['Inner']['errors'], 1)
+            self.assertEqual(exported['types']['List[tests.test_classes.Inner]']['kind'], 'list')
+            self.assertEqual(exported['fields']['Inner.value']['count'], 5)
+            self.assertEqual(exported['kinds']['user_defined']['count'], 6)
+            self.assertGreaterEqual(exported['types']['Outter']['time'], exported['types']['Outter']['self_time'])
+            json.dumps(exported)
+
+            m.disable_stats()
+            self.assertIsNone(m.stats)
+            m.unmarshal(Inner, {'name': 'a', 'value': 1})
+            self.assertEqual(stats.as_dict()['types']['Inner']['count'], 5)
+
+    def test_trusted(self):
+        data = {'name': 'a', 'count': 1, 'ratio': 0.5, 'flag': True, 'ids': [1, 2], 'labels': {'k': 'v'}}
+        for m in (Marshal(trusted=True), Marshal(trusted=True, codegen=True)):
+            result = m.unmarshal(Primitives, data)
+            self.assertEqual(result, Primitives('a', 1, 0.5, True, [1, 2], {'k': 'v'}))
+            self.assertIs(result.ids, data['ids'])
+            self.assertIs(result.labels, data['labels'])
+            coerced = m.unmarshal(Primitives, dict(data, ratio=1, ids=[1, 2.0], labels={'k': 1}))
+            self.assertEqual(coerced, Primitives('a', 1, 1.0, True, [1, 2], {'k': '1'}))
+            self.assertIsInstance(coerced.ratio, float)
+            self.assertIsInstance(coerced.ids[1], int)
+        self.assertIsNot(marshal.unmarshal(Primitives, data).ids, data['ids'])
+
+    def test_intern_and_dedup(self):
+        data = orjson.loads(orjson.dumps([
+            {'street': f'street {i}', 'status': 'act' + 'ive', 'country': {'code': 'US', 'name': 'United States'},
+             'location': [1.5, 2.5]} for i in range(3)
+        ]))
+        for m in (Marshal(intern_strings=['status'], dedup=16), Marshal(intern_strings=True, dedup=16, codegen=True)):
+            addresses = m.unmarshal(List[Address], data)
+            self.assertIs(addresses[0].status, addresses[1].status)
+            self.assertIs(addresses[0].country, addresses[2].country)
+            self.assertIs(addresses[0].location, addresses[1].location)
+            self.assertEqual(addresses[0], Address('street 0', 'active', Country('US', 'United States'), (1.5, 2.5)))
+
+        per_call = Marshal(dedup=16, dedup_per_call=True)
+        first = per_call.unmarshal(List[Address], data)
+        second = per_call.unmarshal(List[Address], data)
+        self.assertIs(first[0].country, first[1].country)
+        self.assertIsNot(first[0].country, second[0].country)
+        self.assertIsNot(marshal.unmarshal(List[Address], data)[0].country,
+                         marshal.unmarshal(List[Address], data)[1].country)
+        restored = pickle.loads(pickle.dumps(Marshal(intern_strings=iter(['status']))))
+        self.assertEqual(restored.config()['intern_strings'], ['status'])
+        self.assertRaises(PymarshalError, lambda: Marshal(intern_strings='status'))
+        with unittest.mock.patch('pymarshaler.marshal._Annotated', None):
+            self.assertRaises(PymarshalError, lambda: Marshal(intern_strings=['status']))
+            Marshal(intern_strings=True)
+
+        mixed = Marshal(dedup=16).unmarshal(List[Tuple[Union[bool, int, float], ...]],
+                                            [[1], [1.0], [True], [0.0], [-0.0], [1]])
+        self.assertEqual([type(value[0]) for value in mixed], [int, float, bool, float, float, int])
+        self.assertEqual(str(mixed[4][0]), '-0.0')
+        self.assertIs(mixed[0], mixed[5])
+        countries = Marshal(dedup=16).unmarshal(List[Country], [{'code': 'US', 'name': 'a'}] * 2)
+        self.assertIs(countries[0], countries[1])
+        for m in (Marshal(dedup=16), Marshal(dedup=16, codegen=True)):
+            tracks = m.unmarshal(List[Track], [{'points': [1.0, 2.0]}, {'points': [1.0, 2.0]}])
+            self.assertIs(tracks[0].points, tracks[1].points)
+        # Frozen wrappers around mutable objects are never shared
+        for cls in (FrozenHolder, HolderTuple):
+            holders = Marshal(dedup=16).unmarshal(List[cls], [{'inner': {'name': 'a', 'value': 1}}] * 2)
+            self.assertIsNot(holders[0], holders[1])
+            self.assertIsNot(holders[0].inner, holders[1].inner)
+        self.assertIsNot(*Marshal(dedup=16).unmarshal(List[Tuple[Any, ...]], [[[1]], [[1]]]))
+
+    def test_update(self):
+        outter = Outter(Inner('a', 1), [Inner('b', 2)])
+        inner = outter.inner
+        self.assertIs(marshal.update(outter, {'inner': {'value': '5'}}), outter)
+        self.assertIs(outter.inner, inner)
+        self.assertEqual(inner, Inner('a', 5))
+        marshal.update(outter, b'{"inner_list": [{"name": "c", "value": 3}]}', list_mode='append')
+        self.assertEqual(outter.inner_list, [Inner('b', 2), Inner('c', 3)])
+        marshal.update(outter, {'inner_list': []})
+        self.assertEqual(outter.inner_list, [])
+        self.assertRaises(UnknownFieldError, lambda: marshal.update(outter, {'unknown': 1}))
+
+        with_dict = ClassWithDict({'a': Inner('a', 1), 'b': Inner('b', 2)})
+        kept = with_dict.d['a']
+        marshal.update(with_dict, {'d': {'a': {'value': 10}, 'b': None, 'c': {'name': 'c', 'value': 3}}},
+                       dict_mode='merge')
+        self.assertEqual(with_dict.d, {'a': Inner('a', 10), 'c': Inner('c', 3)})
+        self.assertIs(with_dict.d['a'], kept)
+        marshal.update(with_dict, {'d': {'z': {'name': 'z', 'value': 0}}})
+        self.assertEqual(with_dict.d, {'z': Inner('z', 0)})
+        optional_dict = ClassWithOptionalDict({'a': 1, 'b': 2})
+        counts = optional_dict.d
+        marshal.update(optional_dict, {'d': {'a': '5', 'b': None, 'c': 3}}, dict_mode='merge')
+        self.assertIs(optional_dict.d, counts)
+        self.assertEqual(counts, {'a': 5, 'c': 3})
+
+        address = Address('street', 'active', Country('US', 'United States'), (1.0, 2.0))
+        marshal.update(address, {'country': {'name': 'USA'}, 'location': [3, 4]})
+        self.assertEqual(address.country, Country('US', 'USA'))
+        self.assertEqual(address.location, (3.0, 4.0))
+        self.assertEqual(marshal.update(Point(1, 2), {'y': 5}), Point(1, 5))
+        self.assertRaises(PymarshalError, lambda: marshal.update(outter, {}, list_mode='merge'))
+
+        # Nothing is changed unless every value decodes
+        outter = Outter(Inner('a', 1), [Inner('b', 2)])
+        inner_list = outter.inner_list
+        self.assertRaises(TypeError, lambda: marshal.update(outter, {'inner': {'value': 7}, 'inner_list': 5}))
+        self.assertRaises(AttributeError, lambda: marshal.update(outter, {'inner_list': [{'name': 'c', 'value': 3}],
+                                                                           'inner': 5}, list_mode='append'))
+        self.assertEqual(outter, Outter(Inner('a', 1), [Inner('b', 2)]))
+        self.assertIs(outter.inner_list, inner_list)
+        with_dict = ClassWithDict({'a': Inner('a', 1)})
+        self.assertRaises(ValueError, lambda: marshal.update(with_dict, {'d': {'a': None, 'b': {'value': 'x'}}},
+                                                             dict_mode='merge'))
+        self.assertEqual(with_dict.d, {'a': Inner('a', 1)})
+
+    def test_codecs(self):
+        attachment = Attachment('a.txt', b'\x00\xff', datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+                                {'x', 'y'})
+        self.assertEqual(orjson.loads(marshal.marshal(attachment))['content'], 'AP8=')
+
+        positional = Marshal(positional=True)
+        self.assertEqual(orjson.loads(positional.marshal(Outter(Inner('a', 1), [Inner('b', 2)]))),
+                         [['a', 1], [['b', 2]]])
+        self.assertEqual(positional.unmarshal_str(Inner, b'["a", 1]'), Inner('a', 1))
+        self.assertEqual(positional.unmarshal_str(Inner, b'{"name": "a", "value": 1}'), Inner('a', 1))
+        self.assertRaises(UnknownFieldError, lambda: positional.unmarshal_str(Inner, b'["a", 1, 2]'))
+        drawing = Drawing([Circle('c', 1.5), Square('s', side=2.0)], None)
+        self.assertEqual(orjson.loads(positional.marshal(drawing)),
+                         [[['Circle', 'c', 1.5], ['square', 's', 'square', 2.0]], None])
+        self.assertEqual(positional.unmarshal_str(Drawing, positional.marshal(drawing)), drawing)
+        self.assertRaises(UnknownFieldError, lambda: positional.unmarshal_str(Shape, b'["Hexagon", "h"]'))
+        self.assertRaises(PymarshalError, lambda: Marshal(codec='yaml'))
+        self.assertRaises(TypeError, Codec)
+
+        for codec, module in (('json', 'orjson'), ('msgpack', 'msgpack'), ('cbor', 'cbor2')):
+            pytest.importorskip(module)
+            for positional in (False, True):
+                m = Marshal(codec=codec, positional=positional)
+                self.assertEqual(m.unmarshal_str(Attachment, m.marshal(attachment)), attachment)
+
+    def test_cache(self):
+        m = Marshal()
+        cache = m.enable_cache(max_entries=2)
+        data = b'{"code": "US", "name": "United States"}'
+        country = m.unmarshal_str(Country, data)
+        self.assertIs(m.unmarshal_str(Country, data.decode()), country)
+        inner = m.unmarshal_str(Inner, b'{"name": "a", "value": 1}')
+        cached = m.unmarshal_str(Inner, b'{"name": "a", "value": 1}')
+        self.assertEqual(cached, inner)
+        self.assertIsNot(cached, inner)
+        self.assertEqual(cache.as_dict()['hits'], 2)
+        self.assertEqual(cache.as_dict()['misses'], 2)
+        payload = b'{"inner": {"name": "a", "value": 1}, "inner_list": [{"name": "b", "value": 2}]}'
+        outter = m.unmarshal_str(Outter, payload)
+        copied = m.unmarshal_str(Outter, payload)
+        self.assertEqual(copied, outter)
+        self.assertIsNot(copied.inner_list, outter.inner_list)
+        self.assertIsNot(copied.inner_list[0], outter.inner_list[0])
+        self.assertIs(copied.inner_list[0].name, outter.inner_list[0].name)
+        address = Address('s', 'active', Country('US', 'United States'), (1.0, 2.0))
+        self.assertEqual(cache_module.clone([address, {'a': [address]}]), [address, {'a': [address]}])
+        self.assertIsNot(cache_module.clone(address), address)
+        m.register_delegate(Inner, lambda x: Inner('delegated', 0))
+        self.assertEqual(cache.as_dict()['entries'], 0)
+
+        m.unmarshal_str(Country, data)
+        m.unmarshal_str(Inner, b'{"name": "b", "value": 2}')
+        self.assertEqual(m.unmarshal_str(Inner, b'{"name": "c", "value": 3}'), Inner('delegated', 0))
+        self.assertEqual(cache.as_dict()['evictions'], 2)
+        self.assertEqual(cache.as_dict()['entries'], 2)
+        self.assertRaises(UnknownFieldError, lambda: m.unmarshal_str(Country, b'{"unknown": 1}'))
+        self.assertRaises(UnknownFieldError, lambda: m.unmarshal_str(Country, b'{"unknown": 1}'))
+
+        shared = Marshal()
+        shared.enable_cache(ttl=0, mode='share')
+        first = shared.unmarshal_str(Inner, b'{"name": "a", "value": 1}')
+        self.assertIsNot(shared.unmarshal_str(Inner, b'{"name": "a", "value": 1}'), first)
+        self.assertEqual(shared.cache.as_dict()['expirations'], 1)
+        shared.disable_cache()
+        self.assertIsNone(shared.cache)
+        self.assertRaises(PymarshalError, lambda: shared.enable_cache(mode='never'))
+
+        # Frozen but holding a list, so every hit gets its own copy
+        auto = Marshal()
+        auto.enable_cache()
+        tagged = auto.unmarshal_str(FrozenTags, b'{"tags": ["a"]}')
+        tagged.tags.append('b')
+        self.assertEqual(auto.unmarshal_str(FrozenTags, b'{"tags": ["a"]}'), FrozenTags(['a']))
+        self.assertEqual(auto.cache.as_dict()['hits'], 1)
 
 def _marshall_and_unmarshall(cls, obj):
     marshalled = Marshal.marshal(obj)
@@ -1,6 +1,10 @@
+import gc
 import unittest
+from dataclasses import make_dataclass
 
-from pymarshaler.utils import is_user_defined, is_builtin
+from pymarshaler import utils
+from pymarshaler.utils import is_user_defined, is_builtin, import_path, import_from_path, get_class_metadata, \
+    get_init_params
 from tests.test_classes import *
 
 
@@ -25,6 +29,29 @@ class TestUtils(unittest.TestCase):
         self.assertFalse(is_builtin(Outter))
         self.assertFalse(is_builtin(datetime.datetime))
 
+    def test_import_path(self):
+        self.assertEqual(import_path(Inner), 'tests.test_classes:Inner')
+        self.assertIs(import_from_path(import_path(Inner)), Inner)
+        self.assertRaises(ValueError, lambda: import_path(lambda x: x))
+
+    def test_class_metadata(self):
+        metadata = get_class_metadata(ClassWithDefaults)
+        self.assertIs(metadata, get_class_metadata(ClassWithDefaults))
+        self.assertEqual(metadata.required, ())
+        self.assertEqual(metadata.defaults, {'value': 10})
+        self.assertFalse(metadata.has_validate)
+        self.assertTrue(get_class_metadata(ClassWithValidate).has_validate)
+        self.assertEqual(get_class_metadata(Outter).params, {'inner': Inner, 'inner_list': List[Inner]})
+        self.assertEqual(get_init_params(ClassWithNonInitField), {'name': str})
+
+    def test_class_metadata_is_weak(self):
+        dynamic = make_dataclass('Dynamic', [('name', str)])
+        self.assertEqual(get_class_metadata(dynamic).required, ('name',))
+        before = len(utils._metadata_cache)
+        del dynamic
+        gc.collect()
+        self.assertEqual(len(utils._metadata_cache), before - 1)
+
 
 if __name__ == '__main__':
     unittest.main()